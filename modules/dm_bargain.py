@@ -3,9 +3,10 @@ from dm_message_model import Message
 
 class Bargain(object):
     """Governs bargaining between agents in self.agents"""
-    def __init__(self, rounds):
+    def __init__(self, rounds, offer_history=None):
         self.agents = []   # list of agent objects who will bargain
-        self.offer_history = []    # list of offer tupples
+        self.offer_history = offer_history  # dm_offer_history.OfferHistory, offers are
+                                            # recorded only if not None
         self.contracts = []   # list of contract tupples
         self.order_book = {}  # dictionary key=trader_id, 
                               #          value = (type, amount)
@@ -18,6 +19,10 @@ class Bargain(object):
         
     def set_debug(self, flag):
         self.debug = flag
+
+    def set_offer_history(self, offer_history):
+        """offer_history = OfferHistory to record offers in, None turns recording off"""
+        self.offer_history = offer_history
     
     def send_msg(self, agent, msg):
         if self.debug:
@@ -114,12 +119,14 @@ class Bargain(object):
                     # put BID in self.order_book
                     offer = ("BID", payload)
                     self.order_book[sender_id] = offer
-                    self.offer_history.append((round, sender_id, "BID", payload)) 
+                    if self.offer_history is not None:
+                        self.offer_history.append((round, sender_id, "BID", payload))
                 elif return_msg.get_directive() == "ASK":
                     # put ask in self.order_book
                     offer = ("ASK", payload)
                     self.order_book[sender_id] = offer
-                    self.offer_history.append((round, sender_id, "ASK", payload))
+                    if self.offer_history is not None:
+                        self.offer_history.append((round, sender_id, "ASK", payload))
                 else:
                     return Message('BAD', agent.get_name(), 'BARGAIN',
                                    "Unrecognized Directive")
@@ -151,7 +158,8 @@ class Bargain(object):
                         continue
                     # process contract
                     price = self.order_book[seller_id][1]
-                    self.offer_history.append((round, buyer_id, "BUY", price))
+                    if self.offer_history is not None:
+                        self.offer_history.append((round, buyer_id, "BUY", price))
                     contract = (round, price, buyer_id, seller_id)
                     self.process_contract(contract)
                 elif directive == "SELL":
@@ -162,7 +170,8 @@ class Bargain(object):
                         continue
                     # process contract
                     price = self.order_book[buyer_id][1]
-                    self.offer_history.append((round, seller_id, "SELL", price))
+                    if self.offer_history is not None:
+                        self.offer_history.append((round, seller_id, "SELL", price))
                     contract = (round, price, buyer_id, seller_id)
                     self.process_contract(contract)
                 else:
@@ -176,7 +185,7 @@ class Bargain(object):
         self.agents = agents
     
     def get_offer_history(self):
-        return self.offer_history()
+        return self.offer_history
     
     def get_contracts(self):
         return self.contracts
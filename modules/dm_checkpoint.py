@@ -0,0 +1,15 @@
+import os
+import pickle
+
+def save_checkpoint(path, state):
+    """Pickle state to path, a crash while writing leaves the last checkpoint intact"""
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+def load_checkpoint(path):
+    """Returns state saved by save_checkpoint, None if there is no checkpoint"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,60 @@
+import csv
+from collections import deque
+
+class OfferHistory(object):
+    """Bounded record of BID, ASK, BUY and SELL offers made in Bargain
+
+       Offers are (round, trader_id, directive, amount) tuples.  Without a
+       spill_path only the last capacity offers are kept (ring buffer).
+       With a spill_path offers are buffered and written to a csv file
+       chunk_size offers at a time, so memory stays bounded and nothing
+       is dropped.
+    """
+
+    FIELDS = ('round', 'trader_id', 'directive', 'amount')
+
+    def __init__(self, capacity=100000, spill_path=None, chunk_size=10000):
+        self.capacity = capacity        # offers kept in memory without a spill_path
+        self.spill_path = spill_path    # csv file offers are streamed to, or None
+        self.chunk_size = chunk_size    # offers buffered before a write to spill_path
+        self.num_offers = 0             # offers recorded, including dropped or spilled ones
+        self.num_spilled = 0            # offers written to spill_path
+        if spill_path is None:
+            self.buffer = deque(maxlen=capacity)
+        else:
+            self.buffer = []
+            with open(spill_path, 'w', newline='') as spill_file:
+                csv.writer(spill_file).writerow(self.FIELDS)
+
+    def __len__(self):
+        return self.num_offers
+
+    def append(self, offer):
+        """Record offer = (round, trader_id, directive, amount)"""
+        self.buffer.append(offer)
+        self.num_offers += 1
+        if self.spill_path is not None and len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered offers to spill_path"""
+        if self.spill_path is None or not self.buffer:
+            return
+        with open(self.spill_path, 'a', newline='') as spill_file:
+            csv.writer(spill_file).writerows(self.buffer)
+        self.num_spilled += len(self.buffer)
+        self.buffer = []
+
+    def get_recent(self):
+        """Returns list of offers still in memory, oldest first"""
+        return list(self.buffer)
+
+    def __iter__(self):
+        """Yields spilled offers then offers still in memory, oldest first"""
+        if self.spill_path is not None:
+            with open(self.spill_path, newline='') as spill_file:
+                reader = csv.reader(spill_file)
+                next(reader)  # header
+                for round, trader_id, directive, amount in reader:
+                    yield int(round), trader_id, directive, int(amount)
+        yield from list(self.buffer)
@@ -0,0 +1,92 @@
+import json
+import queue
+import threading
+
+def to_json(obj):
+    """json.dump default: numpy scalars become Python numbers, anything else a string"""
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+class ResultsWriter(object):
+    """Writes one week of results per line (NDJSON) on a background thread
+
+       Each record is written and flushed as soon as it is handed to write,
+       so a crash only loses the weeks still in the queue.  A record must
+       not be changed after it is passed to write.
+    """
+
+    STOP = None  # queue item telling the writer thread to finish
+
+    def __init__(self, file_name, append=False):
+        self.file_name = file_name
+        self.file = open(file_name, 'a' if append else 'w')
+        self.queue = queue.Queue()
+        self.error = None   # exception raised in the writer thread
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Writer thread: dump records from the queue until STOP"""
+        while True:
+            record = self.queue.get()
+            if record is self.STOP:
+                self.queue.task_done()
+                break
+            if self.error is None:  # after an error records are dropped, wait must not hang
+                try:
+                    self.file.write(json.dumps(record, default=to_json) + "\n")
+                    self.file.flush()
+                except Exception as error:
+                    self.error = error
+            self.queue.task_done()
+        self.file.close()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, record):
+        """Queue record (a dictionary) to be written as one line"""
+        self.check()
+        self.queue.put(record)
+
+    def wait(self):
+        """Block until every record written so far is in the file"""
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """Write queued records and close the file"""
+        self.queue.put(self.STOP)
+        self.thread.join()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def truncate_results(file_name, num_records):
+    """Cut file_name back to its first num_records complete lines, dropping
+       records written after a checkpoint and any partial last line
+    """
+    with open(file_name, 'rb+') as f:
+        for k in range(num_records):
+            if not f.readline().endswith(b"\n"):
+                raise ValueError(f"{file_name} holds only {k} complete records")
+        f.truncate(f.tell())
+
+
+def read_results(file_name):
+    """Yields one week of results at a time from a file made by ResultsWriter,
+       without loading the whole file.  A partial last line left by a crash
+       is skipped.
+    """
+    with open(file_name) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
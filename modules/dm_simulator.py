@@ -12,11 +12,14 @@ import dm_travel
 import dm_agents
 import dm_env as env
 import dm_utils as dm
+from dm_results_writer import ResultsWriter, truncate_results
+from dm_checkpoint import save_checkpoint, load_checkpoint
 
 class SimulateMarket(object):
     """Simulate a market on grid of consisting of weeks and days using two types of trading agents"""
 
-    def __init__(self, sim_name, num_weeks, num_periods, num_rounds, num_traders, trader_types, grid_size, num_units , debug, plot_on):
+    def __init__(self, sim_name, num_weeks, num_periods, num_rounds, num_traders, trader_types, grid_size, num_units , debug, plot_on,
+                 offer_history=None):
 
         self.sim_name = sim_name             # simulation name
         self.num_weeks = num_weeks           # simulation weeks
@@ -28,6 +31,8 @@ class SimulateMarket(object):
         self.num_units = num_units           # number of units, same for all traders
         self.debug = debug                   # if True print additional information
         self.plot_on = plot_on               # if True plot every week, otherwsie plot last week
+        self.offer_history = offer_history   # dm_offer_history.OfferHistory for Bargain,
+                                             #   None = offers not recorded
 
         self.current_week = 0                # Int index for week
         self.location_list = []              # initial location list for all traders
@@ -150,7 +155,7 @@ class SimulateMarket(object):
         agent_list = self.trader_dic[self.current_week]
         t_inst = dm_travel.Travel(self.grid_size, agent_list, debug)
         t_inst.start_travel()
-        b_inst = dm_bargain.Bargain(self.num_rounds)
+        b_inst = dm_bargain.Bargain(self.num_rounds, self.offer_history)
         self.contracts[self.current_week] = {}
         self.prices[self.current_week] = []
         period_ls = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
@@ -200,26 +205,60 @@ class SimulateMarket(object):
             for i in range(len(contract_list)):
                 self.prices[self.current_week].append(contract_list[i][1])
 
-    def make_whole_simulation(self):
+    def make_whole_simulation(self, keep_results=False, checkpoint=False, start_week=0):
         """
         make a whole session: multi-week
+        each week's results are written to sim_name/Results.ndjson as soon as
+        they are made, read them back with dm_results_writer.read_results
+        keep_results = if True also keep every week in self.results_whole
+        checkpoint = if True save the simulation and random states to
+                     sim_name/checkpoint.pkl after every week, see resume_simulation
+        start_week = first week to run, weeks before it are already in Results.ndjson
         """
-        for self.current_week in range(self.num_weeks):
-            print(f"week = {self.current_week}")
-            self.make_whole_trader_list()           # build trader for every week
-            self.make_market()                      # set up market environment for plot
-            self.run_simulation()                   # run simulation for every week
-            if self.plot_on:
-                self.plot_prices()                      # plot supply_demand_prices, and save in a folder
-            elif self.current_week == self.num_weeks - 1:
-                self.plot_prices() 
-            self.display_results()                  # display results
-            self.get_results()                      # store other parameters(num_trader...) to results_whole
-            if self.debug:
-                print(self.get_results())
-
-        # save the dict results_whole to a json file, in the same folder where graphs are
-        json.dump(self.results_whole, open(str(self.sim_name) + "/Results_json.json", "w"))
+        writer = ResultsWriter(str(self.sim_name) + "/Results.ndjson", append=start_week > 0)
+        try:
+            for self.current_week in range(start_week, self.num_weeks):
+                print(f"week = {self.current_week}")
+                self.make_whole_trader_list()           # build trader for every week
+                self.make_market()                      # set up market environment for plot
+                self.run_simulation()                   # run simulation for every week
+                if self.plot_on:
+                    self.plot_prices()                      # plot supply_demand_prices, and save in a folder
+                elif self.current_week == self.num_weeks - 1:
+                    self.plot_prices() 
+                self.display_results()                  # display results
+                results = self.get_results()            # store other parameters(num_trader...) to results_whole
+                if self.debug:
+                    print(results)
+                writer.write(results)                   # stream week to file, in the same folder where graphs are
+                if not keep_results:
+                    del self.results_whole[self.current_week]
+                if checkpoint:
+                    writer.wait()                       # checkpoint only weeks already on disk
+                    self.save_checkpoint()
+        finally:
+            writer.close()                          # queued weeks reach the file even if a week raises
+        if self.offer_history is not None:
+            self.offer_history.flush()
+
+    def checkpoint_name(self):
+        return str(self.sim_name) + "/checkpoint.pkl"
+
+    def save_checkpoint(self):
+        """Save what the next week starts from at the end of current_week: the
+           simulation parameters, this week's traders, the week 0 traders
+           calc_efficiency reads and the random states; other weeks are not saved
+        """
+        parms = {'sim_name': self.sim_name, 'num_weeks': self.num_weeks,
+                 'num_periods': self.num_periods, 'num_rounds': self.num_rounds,
+                 'num_traders': self.num_traders, 'trader_types': self.trader_types,
+                 'grid_size': self.grid_size, 'num_units': self.num_units,
+                 'debug': self.debug, 'plot_on': self.plot_on}
+        save_checkpoint(self.checkpoint_name(),
+                        {'week': self.current_week + 1, 'parms': parms,
+                         'traders': detach_traders(self.trader_dic[self.current_week]),
+                         'first_traders': detach_traders(self.trader_list),
+                         'random': rnd.getstate(), 'np_random': np.random.get_state()})
 
     def plot_prices(self):
         #print(self.prices[self.current_week])
@@ -418,6 +457,38 @@ class SimulateMarket(object):
     def get_sellers(self):
         return self.market.get_sellers()
 
+def detach_traders(traders):
+    """Returns copies of traders without their link to the simulation, so
+       pickling them does not pickle every week the simulation holds
+    """
+    copies = []
+    for t in traders:
+        t = copy.copy(t)
+        t.simulation = None
+        copies.append(t)
+    return copies
+
+def resume_simulation(sim_name, keep_results=False):
+    """Picks up the simulation checkpointed in folder sim_name after its last
+       finished week, returns the SimulateMarket object, None if there is no
+       checkpoint or its simulation ran every week
+    """
+    state = load_checkpoint(str(sim_name) + "/checkpoint.pkl")
+    if state is None or state['week'] >= state['parms']['num_weeks']:
+        return None
+    sim_mkt = SimulateMarket(**state['parms'])
+    # make_whole_trader_list builds the week's traders from the week before
+    sim_mkt.trader_dic[state['week'] - 1] = state['traders']
+    sim_mkt.trader_list = state['first_traders']
+    for t in state['traders'] + state['first_traders']:
+        t.get_simulation(sim_mkt)
+    rnd.setstate(state['random'])
+    np.random.set_state(state['np_random'])
+    # weeks written after the checkpoint are run again
+    truncate_results(str(sim_name) + "/Results.ndjson", state['week'])
+    sim_mkt.make_whole_simulation(keep_results, checkpoint=True, start_week=state['week'])
+    return sim_mkt
+
 if __name__ == "__main__":
 
     ZID = dm_agents.ZID
@@ -434,15 +505,18 @@ if __name__ == "__main__":
     num_units = 10                     # Number of units per trader
     sim_name = "Decentralized-ZIDA-gridsize-10"  # will be the folder name
 
-    if os.path.exists(sim_name):      # delete all files if folder exists
-        for files in os.listdir(sim_name):
-            file = sim_name +'/' + files
-            os.remove(file)
-    if not os.path.exists(sim_name):  # create new folder to store result(dict)
-        os.makedirs(sim_name)
-
-    sim_mkt = SimulateMarket(sim_name, num_weeks, num_periods, num_rounds, num_traders, trader_objects, grid_size, num_units, debug, plot_on)
-    sim_mkt.make_whole_simulation()
+    # rerun after an interruption to resume from the last finished week
+    sim_mkt = resume_simulation(sim_name)
+    if sim_mkt is None:
+        if os.path.exists(sim_name):      # delete all files if folder exists
+            for files in os.listdir(sim_name):
+                file = sim_name +'/' + files
+                os.remove(file)
+        if not os.path.exists(sim_name):  # create new folder to store result(dict)
+            os.makedirs(sim_name)
+
+        sim_mkt = SimulateMarket(sim_name, num_weeks, num_periods, num_rounds, num_traders, trader_objects, grid_size, num_units, debug, plot_on)
+        sim_mkt.make_whole_simulation(checkpoint=True)
 
 
 
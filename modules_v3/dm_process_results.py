@@ -2,7 +2,7 @@ import random as rnd
 #import operator
 #import os
 #import matplotlib.pyplot as plt                 # import matplotlib
-#import numpy as np                              # import numpy
+import numpy as np                              # import numpy
 #import time
 #import copy
 #import json
@@ -39,6 +39,8 @@ class ProcessResults(object):
 
     
     def get_prices(self):
+        if isinstance(self.contracts, np.ndarray):  # ContractLog records
+            return self.contracts['price'].tolist()
         prices = []
         for contract in self.contracts:
             prices.append(contract[1])
@@ -49,52 +51,64 @@ class ProcessResults(object):
         self.market.plot_supply_demand(prices)
 
     def calc_efficiency(self):
-        """
+        """Calculate surplus and efficiency from self.contracts in one pass
+           using the unit value and cost recorded in each extended contract
         """
 
         self.buyer_surplus = 0
         self.seller_surplus = 0
-        self.actual_surplus = 0
-        self.efficiency = 0
-
         self.type_surplus = {}
+        strategy = {}
         for trader in self.agent_list:
-            trader_strategy = trader.name.split("_")[-1]  # trader.name = trader_t_type
-            trader_surplus = 0
-            unit = 0
-            for contract in self.contracts:
-                round_number, price, buyer_name, seller_name, b_cu, b_val, s_cos, s_cu = contract
-                surplus = 0
-                if trader.type == "BUYER":
-                    res = trader.get_values()
-                    if trader.name == buyer_name:
-                        surplus = res[unit] - price
-                        unit = unit + 1
-                        trader_surplus = trader_surplus + surplus
-                        self.buyer_surplus = self.buyer_surplus + surplus
-                       # TODO Figure out type surplus
-                        #self.type_surplus[self.current_week][trader_strategy] = \
-                            #self.type_surplus[self.current_week].get(trader_strategy, 0) + surplus
-                        #print(res, surplus, self.buyer_surplus)
-                else:
-                    costs = trader.get_costs()
-                    if trader.name == seller_name:
-                        surplus = price - costs[unit]
-                        unit = unit + 1
-                        trader_surplus = trader_surplus + surplus
-                        self.seller_surplus = self.seller_surplus + surplus
-                        # TODO Figure out type surplus
-                        #self.type_surplus[self.current_week][trader_strategy] = \
-                            #self.type_surplus[self.current_week].get(trader_strategy, 0) + surplus
-
-                if trader_strategy in self.type_surplus:
-                    self.type_surplus[trader_strategy]+=surplus
-                else:
-                    self.type_surplus[trader_strategy] = surplus
- 
-            self.actual_surplus = self.buyer_surplus + self.seller_surplus
-            eq_units, eq_plow, eq_phigh, eq_max_surplus = self.market.get_equilibrium()
-            self.efficiency = (self.actual_surplus / eq_max_surplus) * 100.0
+            trader_strategy = trader.strategy
+            strategy[trader.name] = trader_strategy
+            self.type_surplus[trader_strategy] = 0
+
+        if isinstance(self.contracts, np.ndarray):  # ContractLog records, ids index agent_list
+            self.calc_record_surplus(strategy)
+            self.set_efficiency()
+            return
+
+        for contract in self.contracts:
+            round_number, price, buyer_name, seller_name, b_cu, b_val, s_cu, s_cos = contract
+            b_surplus = b_val - price
+            s_surplus = price - s_cos
+            self.buyer_surplus = self.buyer_surplus + b_surplus
+            self.seller_surplus = self.seller_surplus + s_surplus
+            self.type_surplus[strategy[buyer_name]] += b_surplus
+            self.type_surplus[strategy[seller_name]] += s_surplus
+
+        self.set_efficiency()
+
+    def calc_record_surplus(self, strategy):
+        """Surplus from ContractLog records, strategy = dictionary trader name -> strategy"""
+        records = self.contracts
+        b_surplus = records['b_value'].astype(np.int64) - records['price']
+        s_surplus = records['price'] - records['s_cost'].astype(np.int64)
+        self.buyer_surplus = int(b_surplus.sum())
+        self.seller_surplus = int(s_surplus.sum())
+        strategies = list(self.type_surplus)
+        trader_type = np.array([strategies.index(strategy[trader.name])
+                                for trader in self.agent_list], dtype=np.int64)
+        by_type = np.zeros(len(strategies), dtype=np.int64)
+        np.add.at(by_type, trader_type[records['buyer']], b_surplus)
+        np.add.at(by_type, trader_type[records['seller']], s_surplus)
+        for k, trader_strategy in enumerate(strategies):
+            self.type_surplus[trader_strategy] = int(by_type[k])
+
+    def set_surplus(self, buyer_surplus, seller_surplus, type_surplus):
+        """Use surplus totals kept at contract time (SimPeriod.get_surplus)
+           instead of recalculating from contracts
+        """
+        self.buyer_surplus = buyer_surplus
+        self.seller_surplus = seller_surplus
+        self.type_surplus = dict(type_surplus)
+        self.set_efficiency()
+
+    def set_efficiency(self):
+        self.actual_surplus = self.buyer_surplus + self.seller_surplus
+        eq_units, eq_plow, eq_phigh, eq_max_surplus = self.market.get_equilibrium()
+        self.efficiency = (self.actual_surplus / eq_max_surplus) * 100.0
 
     
     def get_results(self):
@@ -110,7 +124,8 @@ class ProcessResults(object):
             avg_price = total_price / len(self.prices)
 
         eq_units, eq_plow, eq_phigh, eq_max_surplus = self.market.get_equilibrium()
-        self.calc_efficiency()
+        if self.efficiency is None:
+            self.calc_efficiency()
 
         results = {}
 
@@ -154,8 +169,8 @@ class ProcessResults(object):
             avg_price = total_price / len(self.prices)
 
         eq_units, eq_plow, eq_phigh, eq_max_surplus = self.market.get_equilibrium()
-
-        self.calc_efficiency()
+        if self.efficiency is None:
+            self.calc_efficiency()
 
         print(f"      equilibrium price range is {eq_plow} to {eq_phigh}")
         print(f"      average price = {avg_price}")
@@ -1,41 +1,81 @@
-import random as rnd
+from array import array
 import numpy as np
 from institutions.dm_message_model import Message
 #from dm_zida import ZIDA
 
+def rand_int(rng, low, high):
+    """Returns a random integer in [low, high] drawn from generator rng"""
+    return low + int(rng.random() * (high - low + 1))
+
+def rand_choice(rng, seq):
+    """Returns a random element of seq drawn from generator rng"""
+    return seq[int(rng.random() * len(seq))]
+
+# strategy registry, every Trader subclass is added when it is defined
+STRATEGIES = []       # strategy names, index = strategy code
+STRATEGY_CODES = {}   # dictionary key=strategy name, value = strategy code
+STRATEGY_CLASSES = {} # dictionary key=strategy name, value = class last defined with it
+
+def register_strategy(cls):
+    """Gives cls a strategy name (its class name) and an integer strategy code"""
+    name = cls.__name__
+    if name not in STRATEGY_CODES:
+        STRATEGY_CODES[name] = len(STRATEGIES)
+        STRATEGIES.append(name)
+    STRATEGY_CLASSES[name] = cls
+    cls.strategy = name
+    cls.strategy_code = STRATEGY_CODES[name]
+    return cls
+
 class Trader(object):
     """Base class for Buyers or Seller Agents
-       Decision making is provided by a child class where 
-       overridden methods are those called in process_message
+       Decision making is provided by a child class where
+       overridden methods are the request_* methods which the
+       message methods called in process_message wrap
+
+       Traders use __slots__ so large populations stay small; subclasses
+       that add state must declare their own __slots__.
     """
+
+    __slots__ = ('debug', 'name', 'trader_id', 'type', 'payoff', 'money', 'location',
+                 'lower_bound', 'upper_bound', 'rng', 'values', 'costs',
+                 'units_transacted', 'cur_unit', 'max_units', 'contract_this_period',
+                 'num_at_loc')
+
+    VALID_DIRECTIVES = ("START", "MOVE_REQUESTED", "OFFER", "TRANSACT", "CONTRACT")
+    #TODO: make directives lower case (maybe)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        register_strategy(cls)
     
     def __init__(self, name, trader_type, payoff, money, location,
-                 lower_bound = 0, upper_bound = 9999):
+                 lower_bound = 0, upper_bound = 9999, rng = None, trader_id = None):
         """ name = name of trader
             trader_type = BUYER or SELLER
             payoff = payoff function: utility or profit
             location = starting location of trader
+            rng = numpy random Generator for this trader's decisions
+            trader_id = integer id, index of trader in the agent list
         """
         self.debug = False
         self.name = name          # unique identifier 
+        self.trader_id = trader_id  # integer identifier
         self.type = trader_type   # BUYER or SELLER
         self.payoff = payoff  # utility or profit function
         self.money = money        # starting money ballance
         self.location = location  # starting location a tuple (x, y)
         self.lower_bound = lower_bound # on bids, asks, prices, values, costs
         self.upper_bound = upper_bound # on above
+        self.rng = rng if rng is not None else np.random.default_rng()
 
-        self.values = []  # BUYER values are set by self.set_values(list) 
-        self.costs = []   # SELLER costs are set by self.set_costs(list)
+        self.values = array('i')  # BUYER values are set by self.set_values(list)
+        self.costs = array('i')   # SELLER costs are set by self.set_costs(list)
         self.units_transacted = 0  # Number of units bought or sold
         self.cur_unit = 0     # current unit looking to buy or sell
         self.max_units = 0    # length of values or costs
 
-        self.contracts = []   # list of contracts
-        self.valid_directives = ["START", "MOVE_REQUESTED", "OFFER", "TRANSACT", "CONTRACT"]
-        #TODO: make directives lower case (maybe)
-        self.simulation = None    # get access to class SimulateMarket
-        #TODO: explain above better and why the flag below
+        #TODO: explain why the flag below
         self.contract_this_period = False
         self.num_at_loc = 0
     
@@ -66,11 +106,6 @@ class Trader(object):
         print("round offer: bid ~ [lower_bound, current_value]") 
         print("             ask ~ [current_cost, upper_bound]") 
     
-    #TODO: Check on this.  Is it needed.
-    def get_simulation(self, simulation):
-        self.simulation = simulation
-        return self.simulation
-
     def set_debug(self, flag):
         self.debug = flag
 
@@ -79,17 +114,17 @@ class Trader(object):
  
     def set_values(self, v):
         """
-        Set self.values for buyer from list v 
+        Set self.values for buyer from list v, stored as an int array
         """
-        self.values = v
+        self.values = array('i', v)
         self.max_units = len(v) 
         self.cur_unit = 0 
     
     def set_costs(self, c):
         """
-        Set self.costs for seller from list c 
+        Set self.costs for seller from list c, stored as an int array
         """
-        self.costs = c
+        self.costs = array('i', c)
         self.max_units = len(c)
         self.cur_unit = 0
         
@@ -131,7 +166,7 @@ class Trader(object):
             self.returned_msg(return_msg)
             return return_msg
         directive = message.get_directive()
-        if directive not in self.valid_directives:
+        if directive not in self.VALID_DIRECTIVES:
             return_msg = Message("Bad", self.name, sender, f"02 Unexpected Directive - {directive}")
             self.returned_msg(return_msg)
             return return_msg
@@ -158,13 +193,74 @@ class Trader(object):
         return Message("Stub", self.name, self.name, "02 from start")
 
     def move_requested(self, pl):
-        """Overridden by child
-        """
-        pass
-        return Message("Stub", self.name, self.name, "03 Stub from move_requested")
+        """Wraps request_move in a MOVE message for Travel"""
+        return_msg = Message("MOVE", self.name, "Travel", self.request_move())
+        self.returned_msg(return_msg)
+        return return_msg
+
+    def offer(self, pl):
+        """Wraps request_offer in a BID, ASK or NULL message for Bargain"""
+        offer = self.request_offer(pl)
+        if offer is None:
+            return_msg = Message("NULL", self.name, "BARGAIN", None)
+        else:
+            offer_type, amount = offer
+            return_msg = Message(offer_type, self.name, "BARGAIN", amount)
+        self.returned_msg(return_msg)
+        return return_msg
+
+    def transact(self, pl):
+        """Wraps request_transact in a BUY, SELL or NULL message for Bargain"""
+        order = self.request_transact(pl)
+        if order is None:
+            return_msg = Message("NULL", self.name, "BARGAIN", None)
+        else:
+            order_type, trader_id = order
+            return_msg = Message(order_type, self.name, "BARGAIN", trader_id)
+        self.returned_msg(return_msg)
+        return return_msg
+
+    def contract(self, pl):
+        """Wraps accept_contract in an Update or BAD message for Bargain"""
+        if self.accept_contract(pl):
+            return_msg = Message("Update", self.name, "BARGAIN", 
+                                 "10 Units Updated")
+        elif self.type == 'BUYER':
+            return_msg = Message("BAD", self.name, "BARGAIN", 
+                                 "08 Not buyer contract")
+        else:
+            return_msg = Message("BAD", self.name, "BARGAIN", 
+                                 "09 Not seller contract")
+        self.returned_msg(return_msg)
+        return return_msg
+
+    # Direct-call protocol: institutions in fast-dispatch mode call these
+    # methods without building Messages.  Overridden by child.
+
+    def request_move(self):
+        """Returns move direction (x_dir, y_dir)"""
+        return (0, 0)
+
+    def request_offer(self, order_book):
+        """Returns ("BID", amount), ("ASK", amount) or None for no offer"""
+        return None
+
+    def request_transact(self, order_book):
+        """Returns ("BUY", seller_id), ("SELL", buyer_id) or None for no order"""
+        return None
+
+    def accept_contract(self, contract):
+        """Records contract, returns False if trader is not a party to it"""
+        return False
     
     def get_name(self):
         return self.name
+
+    def get_trader_id(self):
+        return self.trader_id
+
+    def get_strategy(self):
+        return self.strategy
     
     def get_payoff(self, prices):
         if self.type == "BUYER":
@@ -195,12 +291,16 @@ class Trader(object):
     def get_cur_unit(self):
         return self.cur_unit
 
+register_strategy(Trader)
+
 
 class ZID(Trader):
     """ 
         Zero Intelligence variant for decentralized market
         a budget constrained ZI 
     """
+
+    __slots__ = ()
     
     def start(self, pl):
         """
@@ -217,24 +317,20 @@ class ZID(Trader):
         self.returned_msg(return_msg)
         return return_msg
 
-    def move_requested(self, pl):
+    def request_move(self):
         """
         Make a move in a random direction if you can still trade 
         """
         self.contract_this_period = False  # Use this to see if you get a contract this period
         direction_list = [-1, 0, +1] # 
-        if self.cur_unit > self.max_units:
-            return_msg = Message("MOVE", self.name, "Travel", (0, 0))
-            self.returned_msg(return_msg)
-            return return_msg 
+        if self.cur_unit >= self.max_units:
+            return (0, 0)
         else:
-            x_dir = rnd.choice(direction_list)
-            y_dir = rnd.choice(direction_list)
-            return_msg = Message("MOVE", self.name, "Travel", (x_dir, y_dir))
-            self.returned_msg(return_msg)
-            return return_msg 
+            x_dir = rand_choice(self.rng, direction_list)
+            y_dir = rand_choice(self.rng, direction_list)
+            return (x_dir, y_dir)
 
-    def offer(self, pl):
+    def request_offer(self, pl):
         """
         Make a bid or ask 
         """
@@ -242,25 +338,17 @@ class ZID(Trader):
             print(f"-- {self.name} has {self.units_transacted} of {self.max_units}")
             print(f"-- {self.name} working on unit {self.cur_unit}")
         if self.cur_unit >= self.max_units:
-            return_msg = Message("NULL", self.name, "BARGAIN", None)
-            self.returned_msg(return_msg)
-            return return_msg
-            
-        current_offers = pl  # payload from bargain, self.order_book
+            return None
         
         if self.type == "BUYER":
-            WTP = rnd.randint(self.lower_bound, self.values[self.cur_unit])
-            return_msg = Message("BID", self.name, "BARGAIN", WTP)
-            self.returned_msg(return_msg)
-            return return_msg   
+            WTP = rand_int(self.rng, self.lower_bound, self.values[self.cur_unit])
+            return ("BID", WTP)
 
         else: # for SELLER
-            WTA = rnd.randint(self.costs[self.cur_unit], self.upper_bound)
-            return_msg = Message("ASK", self.name, "BARGAIN", WTA)
-            self.returned_msg(return_msg)
-            return return_msg  
+            WTA = rand_int(self.rng, self.costs[self.cur_unit], self.upper_bound)
+            return ("ASK", WTA)
 
-    def transact(self, pl):
+    def request_transact(self, pl):
         """
         Make a buy or sell order
         """
@@ -268,97 +356,49 @@ class ZID(Trader):
             print(f"-- {self.name} has {self.units_transacted} of {self.max_units}")
             print(f"-- {self.name} working on unit {self.cur_unit}")
         if self.cur_unit >= self.max_units:
-            return_msg = Message("NULL", self.name, "BARGAIN", None)
-            self.returned_msg(return_msg)
-            return return_msg
+            return None
             
-        current_offers = pl  # payload from bargain, self.order_book
+        current_offers = pl  # payload from bargain, view of self.order_book
         
         if self.type == "BUYER":
-            WTP = rnd.randint(self.lower_bound, self.values[self.cur_unit])
-            offers = []
-            for trader_id in current_offers:
-                if current_offers[trader_id] == None:
-                    continue
-                offer_type = current_offers[trader_id][0]
-                offer_amount = current_offers[trader_id][1]
-                if offer_type == "ASK":
-                    offers.append((trader_id, offer_amount))
+            WTP = rand_int(self.rng, self.lower_bound, self.values[self.cur_unit])
             # Now find an offer    
-            if len(offers) > 0:
-                offer = rnd.choice(offers)
+            offer = current_offers.random_ask(self.rng)
+            if offer is not None:
                 if WTP >= offer[1]:  # offer[1] = sellers willingness to accept
                     seller_id = offer[0]
-                    return_msg = Message("BUY", self.name, "BARGAIN", seller_id)
-                    self.returned_msg(return_msg)
-                    return return_msg    
-                else:
-                    return_msg = Message("NULL", self.name, "BARGAIN", None)
-                    self.returned_msg(return_msg)
-                    return return_msg   
-            else:
-                return_msg = Message("NULL", self.name, "BARGAIN", None)
-                self.returned_msg(return_msg)
-                return return_msg
+                    return ("BUY", seller_id)
+            return None
             
         else: # for SELLER
-            WTA = rnd.randint(self.costs[self.cur_unit], self.upper_bound)
-            offers = []
-            for trader_id in current_offers:
-                if current_offers[trader_id] == None:
-                    continue
-                offer_type = current_offers[trader_id][0]
-                offer_amount = current_offers[trader_id][1]
-                if offer_type == "BID":
-                    offers.append((trader_id, offer_amount))
+            WTA = rand_int(self.rng, self.costs[self.cur_unit], self.upper_bound)
             # Now find an offer    
-            if len(offers) > 0:
-                offer = rnd.choice(offers)
+            offer = current_offers.random_bid(self.rng)
+            if offer is not None:
                 if WTA <= offer[1]:  # offer[1] = buyers willingness to pay
                     buyer_id = offer[0]
-                    return_msg = Message("SELL", self.name, "BARGAIN", buyer_id)
-                    self.returned_msg(return_msg)
-                    return return_msg    
-                else:
-                    return_msg = Message("NULL", self.name, "BARGAIN", None)
-                    self.returned_msg(return_msg)
-                    return return_msg   
-            else:
-                return_msg = Message("NULL", self.name, "BARGAIN", None)
-                self.returned_msg(return_msg)
-                return return_msg  
-                 
+                    return ("SELL", buyer_id)
+            return None
 
-    def contract(self, pl):
+    def accept_contract(self, pl):
         """
         Update contract information for ZID Trader
         """
         self.contract_this_period = True  # Got a contract this period
         contract = pl
-        price = contract[1]
         buyer_id = contract[2]
         seller_id = contract[3]
         if self.type == 'BUYER':
             if self.get_name() != buyer_id:
-                return_msg = Message("BAD", self.name, "BARGAIN", 
-                                "08 Not buyer contract")
-                self.returned_msg(return_msg)
-                return return_msg                
+                return False
             self.units_transacted += 1
             self.cur_unit += 1
         else:  # SELLER
             if self.get_name() != seller_id:
-                return_msg = Message("BAD", self.name, "BARGAIN", 
-                       "09 Not seller contract")
-                self.returned_msg(return_msg)
-                return return_msg
+                return False
             self.units_transacted += 1
             self.cur_unit += 1
-            
-        return_msg = Message("Update", self.name, "BARGAIN", 
-                             "10 Units Updated")
-        self.returned_msg(return_msg)
-        return return_msg
+        return True
 
 class ZIDA(ZID):
     """
@@ -367,7 +407,9 @@ class ZIDA(ZID):
         <==> Bias to stay in current location
     """
 
-    def move_requested(self, pl):
+    __slots__ = ()
+
+    def request_move(self):
         """
         Make a move in a random direction but with bias to stay if you can still trade
         Stickiness to state quo is determined by the contract number in the last day
@@ -376,35 +418,20 @@ class ZIDA(ZID):
             direction_list = [0, 0, 0]
         else:
             direction_list = [-1, 0, +1]
-        if self.cur_unit > self.max_units:
-            return_msg = Message("MOVE", self.name, "Travel", (0, 0))
-            self.returned_msg(return_msg)
-            return return_msg
+        if self.cur_unit >= self.max_units:
+            return (0, 0)
         else:
-            x_dir = rnd.choice(direction_list)
-            y_dir = rnd.choice(direction_list)
-            return_msg = Message("MOVE", self.name, "Travel", (x_dir, y_dir))
+            x_dir = rand_choice(self.rng, direction_list)
+            y_dir = rand_choice(self.rng, direction_list)
             #self.contract_this_period = False
-            self.returned_msg(return_msg)
-            return return_msg
+            return (x_dir, y_dir)
 
 class ZIDP(ZID):
     """Overrides Bid and Ask Decisions"""
 
-    def find_opt(self, m_type, offers):
-        """returns offer with min ask or max bid to action_requested
-           m_type = 'min' or 'max'
-           offers = (id, amount) either all bids or all asks"""
-
-        y_found = offers[0]
-        for x, y in offers:
-            if m_type == 'max' and y > y_found[1]:
-                y_found = (x, y)
-            if m_type == 'min' and y < y_found[1]:    
-                y_found = (x, y)
-        return y_found
-    
-    def transact(self, pl):
+    __slots__ = ()
+
+    def request_transact(self, pl):
         """
         Make a buy or sell 
         """
@@ -412,67 +439,29 @@ class ZIDP(ZID):
             print(f"-- {self.name} has {self.units_transacted} of {self.max_units}")
             print(f"-- {self.name} working on unit {self.cur_unit}")
         if self.cur_unit >= self.max_units:
-            return_msg = Message("NULL", self.name, "BARGAIN", None)
-            self.returned_msg(return_msg)
-            return return_msg
+            return None
             
-        current_offers = pl  # payload from bargain, self.order_book
+        current_offers = pl  # payload from bargain, view of self.order_book
         
         if self.type == "BUYER":
-            WTP = rnd.randint(self.lower_bound, self.values[self.cur_unit])
-            # collect relavent offers
-            offers = []
-            for trader_id in current_offers:
-                if current_offers[trader_id] == None:
-                    continue
-                offer_type = current_offers[trader_id][0]
-                offer_amount = current_offers[trader_id][1]
-                if offer_type == "ASK":
-                    offers.append((trader_id, offer_amount))
-            # Now find an offer to accept    
-            if len(offers) > 0:
-                offer = self.find_opt('min', offers)
+            WTP = rand_int(self.rng, self.lower_bound, self.values[self.cur_unit])
+            # Now find the lowest ask to accept    
+            offer = current_offers.best_ask()
+            if offer is not None:
                 if WTP >= offer[1]:  # offer[1] = sellers willingness to accept
                     seller_id = offer[0]
-                    return_msg = Message("BUY", self.name, "BARGAIN", seller_id)
-                    self.returned_msg(return_msg)
-                    return return_msg    
-                else:
-                    return_msg = Message("NULL", self.name, "BARGAIN", None)
-                    self.returned_msg(return_msg)
-                    return return_msg   
-            else:
-                return_msg = Message("NULL", self.name, "BARGAIN", None)
-                self.returned_msg(return_msg)
-                return return_msg
+                    return ("BUY", seller_id)
+            return None
             
         else: # for SELLER
-            WTA = rnd.randint(self.costs[self.cur_unit], self.upper_bound)
-            # collect relavent offers
-            offers = []
-            for trader_id in current_offers:
-                if current_offers[trader_id] == None:
-                    continue
-                offer_type = current_offers[trader_id][0]
-                offer_amount = current_offers[trader_id][1]
-                if offer_type == "BID":
-                    offers.append((trader_id, offer_amount))
-            # Now find an offer    
-            if len(offers) > 0:
-                offer = self.find_opt('max', offers)
+            WTA = rand_int(self.rng, self.costs[self.cur_unit], self.upper_bound)
+            # Now find the highest bid to accept    
+            offer = current_offers.best_bid()
+            if offer is not None:
                 if WTA <= offer[1]:  # offer[1] = buyers willingness to pay
                     buyer_id = offer[0]
-                    return_msg = Message("SELL", self.name, "BARGAIN", buyer_id)
-                    self.returned_msg(return_msg)
-                    return return_msg    
-                else:
-                    return_msg = Message("NULL", self.name, "BARGAIN", None)
-                    self.returned_msg(return_msg)
-                    return return_msg   
-            else:
-                return_msg = Message("NULL", self.name, "BARGAIN", None)
-                self.returned_msg(return_msg)
-                return return_msg  
+                    return ("SELL", buyer_id)
+            return None
  
 class ZIDPA(ZIDP):
     """
@@ -481,7 +470,9 @@ class ZIDPA(ZIDP):
         <==> Bias to stay in current location
     """
 
-    def move_requested(self, pl):
+    __slots__ = ()
+
+    def request_move(self):
         """
         Make a move in a random direction but with bias to stay if you made a contract in the past.
         """
@@ -489,17 +480,13 @@ class ZIDPA(ZIDP):
             direction_list = [0, 0, 0]
         else:
             direction_list = [-1, 0, +1]
-        if self.cur_unit > self.max_units:
-            return_msg = Message("MOVE", self.name, "Travel", (0, 0))
-            self.returned_msg(return_msg)
-            return return_msg
+        if self.cur_unit >= self.max_units:
+            return (0, 0)
         else:
-            x_dir = rnd.choice(direction_list)
-            y_dir = rnd.choice(direction_list)
-            return_msg = Message("MOVE", self.name, "Travel", (x_dir, y_dir))
-            self.returned_msg(return_msg)
+            x_dir = rand_choice(self.rng, direction_list)
+            y_dir = rand_choice(self.rng, direction_list)
             #self.contract_this_period = False
-            return return_msg
+            return (x_dir, y_dir)
 
 class ZIDPR(ZIDP):
     """
@@ -508,7 +495,9 @@ class ZIDPR(ZIDP):
         <==> Bias to stay in current location
     """
 
-    def move_requested(self, pl):
+    __slots__ = ()
+
+    def request_move(self):
         """
         Make a move in a random direction but with bias to stay if you can still trade
         Stickiness to state quo is determined by the contract number in the last day
@@ -521,15 +510,10 @@ class ZIDPR(ZIDP):
         if self.num_at_loc > 2:
             #print('NUMBER AT g', self.num_at_loc)
             direction_list = [-1, +1]
-        if self.cur_unit > self.max_units:
-            return_msg = Message("MOVE", self.name, "Travel", (0, 0))
-            self.returned_msg(return_msg)
-            return return_msg
+        if self.cur_unit >= self.max_units:
+            return (0, 0)
         else:
-            x_dir = rnd.choice(direction_list)
-            y_dir = rnd.choice(direction_list)
-            return_msg = Message("MOVE", self.name, "Travel", (x_dir, y_dir))
-            self.returned_msg(return_msg)
+            x_dir = rand_choice(self.rng, direction_list)
+            y_dir = rand_choice(self.rng, direction_list)
             #self.contract_this_period = False
-            return return_msg
-        
\ No newline at end of file
+            return (x_dir, y_dir)
@@ -7,6 +7,73 @@ import copy
 import os
 import json
 
+NO_COST = 999999999  # big number > max cost ever, used as the first rejected cost
+                     #   when every unit that can be matched is accepted
+
+def calc_equilibria(values, costs):
+    """ Calculate Competitive Equilibrium information for a batch of markets
+        in one NumPy pass, same results as SpotMarketEnvironment.calc_equilibrium
+        values = (markets x buyer units) array of every buyer unit value in each market
+        costs = (markets x seller units) array of every seller unit cost in each market
+        Markets with fewer units are padded with value -1 and cost NO_COST,
+        padded units are treated as missing just as zip stops at the
+        shorter of demand and supply in calc_equilibrium.
+        returns arrays eq_units, eq_price_low, eq_price_high, max_surplus,
+        prices are nan for markets with no equilibrium (eq_units <= 1)
+    """
+    demand = -np.sort(-np.asarray(values, dtype=np.int64), axis=1)  # high to low
+    supply = np.sort(np.asarray(costs, dtype=np.int64), axis=1)     # low to high
+    n = min(demand.shape[1], supply.shape[1])  # units matched in order, as zip does
+    demand = demand[:, :n]
+    supply = supply[:, :n]
+    num_markets = demand.shape[0]
+
+    # demand falls and supply rises so accepted units are a prefix of each row
+    accepted = demand >= supply
+    eq_units = accepted.sum(axis=1)
+    max_surplus = np.where(accepted, demand - supply, 0).sum(axis=1)
+
+    rows = np.arange(num_markets)
+    last = np.maximum(eq_units - 1, 0)
+    first_rejected = np.minimum(eq_units, n - 1) if n > 0 else last
+    num_matched = np.minimum((demand >= 0).sum(axis=1), (supply < NO_COST).sum(axis=1))
+    rejected = eq_units < num_matched  # False when every matched unit was accepted
+    if n > 0:
+        last_accepted_value = demand[rows, last]
+        last_accepted_cost = supply[rows, last]
+        first_rejected_value = np.where(rejected, demand[rows, first_rejected], 0)
+        first_rejected_cost = np.where(rejected, supply[rows, first_rejected], NO_COST)
+    else:
+        last_accepted_value = last_accepted_cost = first_rejected_value = np.zeros(num_markets, dtype=np.int64)
+        first_rejected_cost = np.full(num_markets, NO_COST, dtype=np.int64)
+
+    found = eq_units > 1
+    eq_price_high = np.where(found, np.minimum(last_accepted_value, first_rejected_cost), np.nan)
+    eq_price_low = np.where(found, np.maximum(last_accepted_cost, first_rejected_value), np.nan)
+    return eq_units, eq_price_low, eq_price_high, max_surplus
+
+
+def calc_market_equilibria(markets):
+    """ Calculate and set the equilibrium of every SpotMarketEnvironment in
+        markets with one call to calc_equilibria
+    """
+    demands = [[value for values in market.buyers.values() for value in values]
+               for market in markets]
+    supplies = [[cost for costs in market.sellers.values() for cost in costs]
+                for market in markets]
+    max_demand = max((len(demand) for demand in demands), default=0)
+    max_supply = max((len(supply) for supply in supplies), default=0)
+    values = np.full((len(markets), max_demand), -1, dtype=np.int64)
+    costs = np.full((len(markets), max_supply), NO_COST, dtype=np.int64)
+    for k, (demand, supply) in enumerate(zip(demands, supplies)):
+        values[k, :len(demand)] = demand
+        costs[k, :len(supply)] = supply
+
+    equilibria = calc_equilibria(values, costs)
+    for market, (eq_units, eq_price_low, eq_price_high, max_surplus) in zip(markets, zip(*equilibria)):
+        market.set_equilibrium(eq_units, eq_price_low, eq_price_high, max_surplus)
+
+
 class SpotMarketEnvironment(object):
     """ A class that makes a market environment consisting of buyers who make
         up the demand curve and sellers who make up the supply curve.  This
@@ -118,10 +185,19 @@ class SpotMarketEnvironment(object):
         self.supply = sorted(self.supply, key=operator.itemgetter(1), \
                              reverse=False)
 
+    def make_curves(self):
+        """ Makes demand and supply lists if they have not been made, markets
+            solved by calc_market_equilibria do not need them
+        """
+        if not self.demand and not self.supply:
+            self.make_demand()
+            self.make_supply()
+
     def show_supply_demand(self):
         """Prints supply and demand in a table where each row represnts a
            price from high to low.
         """
+        self.make_curves()
         supply_and_demand = self.supply + self.demand
         supply_and_demand = sorted(supply_and_demand, key=operator.itemgetter(1), reverse=True)
         print("Unit    ID       Cost  | Value     ID")
@@ -140,13 +216,14 @@ class SpotMarketEnvironment(object):
             eq_units
             max_surplus
         """
+        self.make_curves()
 
         self.max_surplus = 0
         self.eq_units = 0
         last_accepted_value = 0
         last_accepted_cost = 0
         first_rejected_value = 0
-        first_rejected_cost = 999999999  # big number > max cost ever
+        first_rejected_cost = NO_COST  # big number > max cost ever
 
         for buy_unit, sell_unit in zip(self.demand, self.supply):
             buyid, value = buy_unit
@@ -179,11 +256,22 @@ class SpotMarketEnvironment(object):
     def get_equilibrium(self):
         return self.eq_units, self.eq_price_low, self.eq_price_high, self.max_surplus
 
+    def set_equilibrium(self, eq_units, eq_price_low, eq_price_high, max_surplus):
+        """Set equilibrium calculated elsewhere (calc_equilibria) instead of calc_equilibrium
+           prices are nan when there is no equilibrium
+        """
+        self.eq_units = int(eq_units)
+        self.max_surplus = int(max_surplus)
+        if self.eq_units > 1:
+            self.eq_price_low = int(eq_price_low)
+            self.eq_price_high = int(eq_price_high)
+
     def plot_supply_demand(self, prices=[]):
 
         """
         First define supply and demand curves
         """
+        self.make_curves()
         # make x-axis arrays for demand_units and supply_units
         dunits = [units for units in range(len(self.demand) + 2)]
         sunits = [units for units in range(len(self.supply) + 1)]
@@ -1,4 +1,3 @@
-import random as rnd
 import operator
 import matplotlib.pyplot as plt                 # import matplotlib
 import numpy as np                              # import numpy
@@ -16,7 +15,7 @@ debug = False
 class MakeAgents(object):
     """Class to make agents to be used in centralized and decentralized trading"""
     def __init__(self, num_traders, trader_types, num_units,
-                 grid_size, lower_bound, upper_bound, debug=False):
+                 grid_size, lower_bound, upper_bound, debug=False, rng=None):
 
         self.trader_types = trader_types     # list of two trader types, should be tuple
         self.num_traders = num_traders       # number of traders divisible by two
@@ -28,9 +27,11 @@ class MakeAgents(object):
         self.agents = []                     # contains list of agents
         self.location_list = []
         self.market = None
-        
+        self.rng = rng if rng is not None else np.random.default_rng()  # locations, values,
+                                             # strategies and a child stream for each trader
 
-    def utility(self, q, m, v, p):
+    @staticmethod
+    def utility(q, m, v, p):
         """Calculates utility payoff
         args:  q = quantity bought
                 m = money
@@ -41,7 +42,8 @@ class MakeAgents(object):
         sum_p = sum(p[0:q])  # sum first q elements of p
         return sum_v + m - sum_p
 
-    def profit(self, q, m, c, p):
+    @staticmethod
+    def profit(q, m, c, p):
         """Calculates profit payoff
         args:  q = quantity sold
                 m = money
@@ -56,16 +58,17 @@ class MakeAgents(object):
         """Helper function to initialize test agents"""
 
         ZID = dm_agents.ZID
+        rngs = self.rng.spawn(8)
 
-        b_1 = ZID('B1', 'BUYER', self.utility, 500, (0, 0), 20, 100)
-        b_2 = ZID('B2', 'BUYER', self.utility, 500, (0, 0), 20, 100)
-        b_3 = ZID('B3', 'BUYER', self.utility, 500, (0, 0), 20, 100)
-        b_4 = ZID('B4', 'BUYER', self.utility, 500, (0, 0), 20, 100)
+        b_1 = ZID('B1', 'BUYER', self.utility, 500, (0, 0), 20, 100, rngs[0])
+        b_2 = ZID('B2', 'BUYER', self.utility, 500, (0, 0), 20, 100, rngs[1])
+        b_3 = ZID('B3', 'BUYER', self.utility, 500, (0, 0), 20, 100, rngs[2])
+        b_4 = ZID('B4', 'BUYER', self.utility, 500, (0, 0), 20, 100, rngs[3])
 
-        s_1 = ZID('S1', 'SELLER', self.profit, 500, (0, 0), 20, 100)
-        s_2 = ZID('S2', 'SELLER', self.profit, 500, (0, 0), 20, 100)
-        s_3 = ZID('S3', 'SELLER', self.profit, 500, (0, 0), 20, 100)
-        s_4 = ZID('S4', 'SELLER', self.profit, 500, (0, 0), 20, 100)
+        s_1 = ZID('S1', 'SELLER', self.profit, 500, (0, 0), 20, 100, rngs[4])
+        s_2 = ZID('S2', 'SELLER', self.profit, 500, (0, 0), 20, 100, rngs[5])
+        s_3 = ZID('S3', 'SELLER', self.profit, 500, (0, 0), 20, 100, rngs[6])
+        s_4 = ZID('S4', 'SELLER', self.profit, 500, (0, 0), 20, 100, rngs[7])
 
         b_1.set_values([100, 90, 50, 20])
         b_2.set_values([100, 90, 50, 20])
@@ -86,8 +89,8 @@ class MakeAgents(object):
         """Initialize trader locations for make_agents."""
         self.location_list = []
         for i in range(self.num_traders):
-            x = rnd.randint(0,self.grid_size-1)
-            y = rnd.randint(0,self.grid_size-1)
+            x = int(self.rng.integers(0, self.grid_size))
+            y = int(self.rng.integers(0, self.grid_size))
             self.location_list.append((x, y))
     
     def set_locations(self, grid_size):
@@ -108,7 +111,7 @@ class MakeAgents(object):
             upper = self.ub
             lower = self.lb + interval
             for unit in range(self.num_units):
-                value = np.random.randint(lower, upper+1)
+                value = int(self.rng.integers(lower, upper+1))
                 values.append(value)
             return sorted(values, reverse=True)  # Insures declining marginal value
         else:
@@ -116,7 +119,7 @@ class MakeAgents(object):
             upper = self.ub - interval
             lower = self.lb
             for unit in range(self.num_units):
-                cost = np.random.randint(lower, upper+1)
+                cost = int(self.rng.integers(lower, upper+1))
                 costs.append(cost)
             return sorted(costs, reverse=False)  # Insures increasing marginal cost
 
@@ -139,7 +142,8 @@ class MakeAgents(object):
                 traders.append(t_name)
         assert len(traders) == self.num_traders, f"num_traders {self.num_traders} != length of traders"
         # randomize trader strategies one for each agent
-        np.random.shuffle(traders)
+        self.rng.shuffle(traders)
+        trader_rngs = self.rng.spawn(self.num_traders)  # one independent stream per trader
 
         # Assign trader objects to buyer/seller roles and assign values and costs
         self.agents = []
@@ -160,7 +164,8 @@ class MakeAgents(object):
             location = self.location_list[t]   # get initial location
             # initialize agent with info constructed above
             agent = agent_model(name, trader_role, payoff, money, location, 
-                                lower_bound = self.lb, upper_bound = self.ub)
+                                lower_bound = self.lb, upper_bound = self.ub,
+                                rng = trader_rngs[t], trader_id = t)
             # Make Value list or cost list
             if agent.get_type() == "BUYER":
                 values = self.gen_res_values(True)
@@ -179,8 +184,12 @@ class MakeAgents(object):
         for agent in agent_list:
             print(agent)
 
-    def make_market(self, market_name):
+    def make_market(self, market_name, calc_equilibrium=True):
         """Make MarketEnviornment object from traders
+           calc_equilibrium = False leaves the equilibrium to be set for many
+                              markets at once by dm_env.calc_market_equilibria,
+                              and the sorted demand and supply lists to be
+                              made when first needed
         """
         # self.build_traders()
         num_side = self.num_traders // 2
@@ -193,9 +202,10 @@ class MakeAgents(object):
                 seller_index = index - num_side  # sellers start at 0 in market environment
                 costs = trader.get_costs()
                 self.market.add_seller(seller_index, costs)
-        self.market.make_demand()
-        self.market.make_supply()
-        self.market.calc_equilibrium()
+        if calc_equilibrium:
+            self.market.make_demand()
+            self.market.make_supply()
+            self.market.calc_equilibrium()
     
     def get_market(self):
         return self.market
@@ -1,23 +1,75 @@
-import random as rnd
+import numpy as np
 from institutions.dm_message_model import Message
+from institutions.dm_order_book import OrderBook
 
 class Bargain(object):
     """Governs bargaining between agents in self.agents"""
-    def __init__(self, rounds):
+    def __init__(self, rounds, fast_dispatch=False, rng=None, offer_history=None, prune=False):
         self.agents = []   # list of agent objects who will bargain
-        self.offer_history = []    # list of offer tupples
+        self.offer_history = offer_history  # dm_offer_history.OfferHistory, offers are
+                                            #   only recorded when not None
         self.contracts = []   # list of contract tupples
-        self.order_book = {}  # dictionary key=trader_id, 
-                              #          value = (type, amount)
-                              #          type = 'BID', 'ASK' 
+        self.order_book = OrderBook()  # standing offers, bids and asks kept apart
+                                       #   agents see it through order_book.view()
         self.agent_order = []  # list of shuffled agents
         self.agent_lookup = {} # dictionary key=trader_id, 
                                #         value = index into agent_order
         self.rounds = rounds  # number of rounds of bargaining
         self.debug = False  # used to print information for debugging
+        self.fast_dispatch = fast_dispatch  # if True call agent request_* methods
+                                            # directly instead of sending Messages
+        self.rng = rng if rng is not None else np.random.default_rng()  # shuffles agent order
+        self.buyer_surplus = 0   # running totals over contracts since reset_surplus
+        self.seller_surplus = 0  #   buyer: value - price, seller: price - cost
+        self.type_surplus = {}   # running surplus by trader strategy
+        self.prune = prune       # if True stop a session once no contract is possible
+        self.skipped_rounds = 0  # rounds not run because no contract was possible,
+                                 #   since reset_skipped_rounds
         
     def set_debug(self, flag):
         self.debug = flag
+
+    def set_fast_dispatch(self, flag):
+        self.fast_dispatch = flag
+
+    def set_offer_history(self, offer_history):
+        """offer_history = OfferHistory to record offers in, None turns recording off"""
+        self.offer_history = offer_history
+
+    def reset_surplus(self):
+        self.buyer_surplus = 0
+        self.seller_surplus = 0
+        self.type_surplus = {}
+
+    def reset_skipped_rounds(self):
+        self.skipped_rounds = 0
+
+    def get_skipped_rounds(self):
+        return self.skipped_rounds
+
+    def trade_possible(self):
+        """Returns True if some buyer's current unit value is at least some
+           seller's current unit cost, traders are budget constrained so no
+           contract can be made otherwise
+        """
+        max_value = None
+        min_cost = None
+        for agent in self.agents:
+            if agent.cur_unit >= agent.max_units:
+                continue  # no units left
+            if agent.type == "BUYER":
+                value = agent.values[agent.cur_unit]
+                if max_value is None or value > max_value:
+                    max_value = value
+            else:
+                cost = agent.costs[agent.cur_unit]
+                if min_cost is None or cost < min_cost:
+                    min_cost = cost
+        return max_value is not None and min_cost is not None and max_value >= min_cost
+
+    def get_surplus(self):
+        """Returns buyer_surplus, seller_surplus, type_surplus since reset_surplus"""
+        return self.buyer_surplus, self.seller_surplus, self.type_surplus
     
     def send_msg(self, agent, msg):
         if self.debug:
@@ -29,14 +81,36 @@ class Bargain(object):
         return_msg = agent.process_message(msg)
         return return_msg
 
+    def request_offer(self, agent):
+        """Returns (directive, sender_id, payload) for agent's BID, ASK or NULL"""
+        if self.fast_dispatch:
+            offer = agent.request_offer(self.order_book.view())
+            if offer is None:
+                return "NULL", agent.name, None
+            return offer[0], agent.name, offer[1]
+        msg = Message('OFFER', 'BARGAIN', agent.get_name(), self.order_book.view())
+        return_msg = self.send_msg(agent, msg)
+        return return_msg.get_directive(), return_msg.get_sender(), return_msg.get_payload()
+
+    def request_transact(self, agent):
+        """Returns (directive, sender_id, payload) for agent's BUY, SELL or NULL"""
+        if self.fast_dispatch:
+            order = agent.request_transact(self.order_book.view())
+            if order is None:
+                return "NULL", agent.name, None
+            return order[0], agent.name, order[1]
+        msg = Message('TRANSACT', 'BARGAIN', agent.get_name(), self.order_book.view())
+        return_msg = self.send_msg(agent, msg)
+        return return_msg.get_directive(), return_msg.get_sender(), return_msg.get_payload()
+
     def make_bargaining_order(self):
         """ Shuffles agents and creates self.agent_lookup
             to get index of agent in agent_order"""
 
-        rnd.shuffle(self.agent_order)
+        self.rng.shuffle(self.agent_order)
+        self.order_book.clear()
         for k, agent in enumerate(self.agent_order):
             name = agent.get_name()
-            self.order_book[name] = None
             self.agent_lookup[name] = k  
 
     def process_contract(self, contract):
@@ -47,8 +121,8 @@ class Bargain(object):
         round, price, buyer_id, seller_id = contract
 
         # cancel orders after contract 
-        self.order_book[buyer_id] = None
-        self.order_book[seller_id] = None
+        self.order_book.cancel(buyer_id)
+        self.order_book.cancel(seller_id)
 
         # get agent objects
         buyer_agent_index = self.agent_lookup[buyer_id]
@@ -66,15 +140,29 @@ class Bargain(object):
         b_cur_value = b_values[b_cur_unit]
 
         # Send messages to buyer and seller that they have a contract
-        msg = Message('CONTRACT', 'BARGAIN', buyer_id, contract)
-        return_msg = buyer_agent.process_message(msg) # Send to buyer
-        msg = Message('CONTRACT', 'BARGAIN', seller_id, contract)
-        return_msg = seller_agent.process_message(msg)  # Send to seller
+        if self.fast_dispatch:
+            buyer_agent.accept_contract(contract)
+            seller_agent.accept_contract(contract)
+        else:
+            msg = Message('CONTRACT', 'BARGAIN', buyer_id, contract)
+            return_msg = buyer_agent.process_message(msg) # Send to buyer
+            msg = Message('CONTRACT', 'BARGAIN', seller_id, contract)
+            return_msg = seller_agent.process_message(msg)  # Send to seller
 
         # save extended contract
         ex_contract = (round, price, buyer_id, seller_id, b_cur_unit, b_cur_value, s_cur_unit, s_cur_cost)
         self.contracts.append(ex_contract)
 
+        # update running surplus by trader strategy
+        b_surplus = b_cur_value - price
+        s_surplus = price - s_cur_cost
+        self.buyer_surplus += b_surplus
+        self.seller_surplus += s_surplus
+        b_strategy = buyer_agent.strategy
+        s_strategy = seller_agent.strategy
+        self.type_surplus[b_strategy] = self.type_surplus.get(b_strategy, 0) + b_surplus
+        self.type_surplus[s_strategy] = self.type_surplus.get(s_strategy, 0) + s_surplus
+
         if self.debug:
             print(contract)
             print(ex_contract)
@@ -87,24 +175,29 @@ class Bargain(object):
            Bargaining continues for self.rounds
               Each round agent order is shuffled then
                 Each agent makes a BID, ASK BUY or SELL order
-                Only the most recent order is kept"""
+                Only the most recent order is kept
+           With self.prune bargaining stops before any round where no contract
+           is possible, checked at the start and after rounds with contracts"""
         
         self.agent_order = self.agents
-        self.order_book = {}
+        self.order_book.clear()
         self.contracts = []
+        history = self.offer_history
+        check_trade = self.prune  # feasibility only changes when contracts are made
         
         # Begin Bargaining
         for round in range(self.rounds):
+            if check_trade:
+                if not self.trade_possible():
+                    self.skipped_rounds += self.rounds - round
+                    break
+                check_trade = False
+            num_contracts = len(self.contracts)
             self.make_bargaining_order()
             for agent in self.agent_order:
 
                 # Request and Get: BID, ASK, BUY or SELL message
-                agent_id = agent.get_name()
-                msg = Message('OFFER', 'BARGAIN', agent_id, self.order_book)
-                return_msg = self.send_msg(agent, msg)
-                directive = return_msg.get_directive()
-                sender_id = return_msg.get_sender()
-                payload = return_msg.get_payload()
+                directive, sender_id, payload = self.request_offer(agent)
                 #print(f"{sender_id}  {directive}  {payload}")
                 # Process message based on directive
                 if directive == "NULL":
@@ -112,31 +205,26 @@ class Bargain(object):
                     continue
                 elif directive == "BID":
                     # put BID in self.order_book
-                    offer = ("BID", payload)
-                    self.order_book[sender_id] = offer
-                    self.offer_history.append((round, sender_id, "BID", payload)) 
-                elif return_msg.get_directive() == "ASK":
+                    self.order_book.add(sender_id, "BID", payload)
+                    if history is not None:
+                        history.append((round, sender_id, "BID", payload))
+                elif directive == "ASK":
                     # put ask in self.order_book
-                    offer = ("ASK", payload)
-                    self.order_book[sender_id] = offer
-                    self.offer_history.append((round, sender_id, "ASK", payload))
+                    self.order_book.add(sender_id, "ASK", payload)
+                    if history is not None:
+                        history.append((round, sender_id, "ASK", payload))
                 else:
                     return Message('BAD', agent.get_name(), 'BARGAIN',
                                    "Unrecognized Directive")
             if self.debug:
                 for agent in self.agent_order:
-                    print(f"{self.order_book[agent.get_name()]}", end = " ")
+                    print(f"{self.order_book.get(agent.get_name())}", end = " ")
                 print()
 
             for agent in self.agent_order:
 
                 # Request and Get: BID, ASK, BUY or SELL message
-                agent_id = agent.get_name()
-                msg = Message('TRANSACT', 'BARGAIN', agent_id, self.order_book)
-                return_msg = self.send_msg(agent, msg)
-                directive = return_msg.get_directive()
-                sender_id = return_msg.get_sender()
-                payload = return_msg.get_payload()
+                directive, sender_id, payload = self.request_transact(agent)
 
                 # Process message based on directive
                 if directive == "NULL":
@@ -146,28 +234,33 @@ class Bargain(object):
                     # make contract if possible
                     buyer_id = sender_id  
                     seller_id = payload
-                    if self.order_book[seller_id] == None:
+                    offer = self.order_book.get(seller_id)
+                    if offer == None:
                         # cannot make contract continue to next agent
                         continue
                     # process contract
-                    price = self.order_book[seller_id][1]
-                    self.offer_history.append((round, buyer_id, "BUY", price))
+                    price = offer[1]
+                    if history is not None:
+                        history.append((round, buyer_id, "BUY", price))
                     contract = (round, price, buyer_id, seller_id)
                     self.process_contract(contract)
                 elif directive == "SELL":
                     seller_id = sender_id  # Get Mappings to buyer_id and seller_id
                     buyer_id = payload
-                    if self.order_book[buyer_id] == None:
+                    offer = self.order_book.get(buyer_id)
+                    if offer == None:
                         # cannot contract continue to next agent
                         continue
                     # process contract
-                    price = self.order_book[buyer_id][1]
-                    self.offer_history.append((round, seller_id, "SELL", price))
+                    price = offer[1]
+                    if history is not None:
+                        history.append((round, seller_id, "SELL", price))
                     contract = (round, price, buyer_id, seller_id)
                     self.process_contract(contract)
                 else:
                     return Message('BAD', agent.get_name(), 'BARGAIN',
                                    "Unrecognized Directive") 
+            check_trade = self.prune and len(self.contracts) > num_contracts
         if self.debug:
             print(self.contracts)
         test_test = 1
@@ -176,7 +269,7 @@ class Bargain(object):
         self.agents = agents
     
     def get_offer_history(self):
-        return self.offer_history()
+        return self.offer_history
     
     def get_contracts(self):
         return self.contracts
@@ -0,0 +1,136 @@
+import heapq
+
+class OrderBook(object):
+    """Order book for a bargaining session with bids and asks kept apart
+
+       Each trader has at most one standing offer.  Best bid and best ask
+       come from heaps with lazy deletion (O(log n)), random offers from
+       dense id lists with swap-remove (O(1)).
+    """
+
+    def __init__(self):
+        self.offers = {}      # dictionary key=trader_id, value = (type, amount, seq)
+        self.ids = {"BID": [], "ASK": []}    # trader_ids with standing offers
+        self.position = {}    # dictionary key=trader_id, value = index into self.ids[type]
+        self.bid_heap = []    # (-amount, seq, trader_id), best bid on top
+        self.ask_heap = []    # (amount, seq, trader_id), best ask on top
+        self.seq = 0          # offer counter, ties go to the earlier offer
+        self.book_view = OrderBookView(self)
+
+    def view(self):
+        """Returns read-only view of the book passed to agents"""
+        return self.book_view
+
+    def clear(self):
+        """Cancel all offers"""
+        self.offers = {}
+        self.ids = {"BID": [], "ASK": []}
+        self.position = {}
+        self.bid_heap = []
+        self.ask_heap = []
+
+    def add(self, trader_id, offer_type, amount):
+        """Add BID or ASK for trader_id replacing any standing offer"""
+        self.cancel(trader_id)
+        self.seq += 1
+        self.offers[trader_id] = (offer_type, amount, self.seq)
+        ids = self.ids[offer_type]
+        self.position[trader_id] = len(ids)
+        ids.append(trader_id)
+        if offer_type == "BID":
+            heapq.heappush(self.bid_heap, (-amount, self.seq, trader_id))
+        else:
+            heapq.heappush(self.ask_heap, (amount, self.seq, trader_id))
+
+    def cancel(self, trader_id):
+        """Cancel trader_id's standing offer if there is one"""
+        offer = self.offers.pop(trader_id, None)
+        if offer is None:
+            return
+        ids = self.ids[offer[0]]
+        k = self.position.pop(trader_id)
+        last = ids.pop()
+        if last != trader_id:
+            ids[k] = last
+            self.position[last] = k
+
+    def get(self, trader_id):
+        """Returns (type, amount) of trader_id's standing offer or None"""
+        offer = self.offers.get(trader_id)
+        if offer is None:
+            return None
+        return offer[0], offer[1]
+
+    def best(self, heap, sign):
+        """Returns (trader_id, amount) on top of heap after dropping stale entries"""
+        while heap:
+            key, seq, trader_id = heap[0]
+            offer = self.offers.get(trader_id)
+            if offer is not None and offer[2] == seq:
+                return trader_id, sign * key
+            heapq.heappop(heap)
+        return None
+
+    def best_bid(self):
+        return self.best(self.bid_heap, -1)
+
+    def best_ask(self):
+        return self.best(self.ask_heap, 1)
+
+    def random_offer(self, offer_type, rng):
+        """Returns (trader_id, amount) of a uniformly chosen offer of offer_type or None"""
+        ids = self.ids[offer_type]
+        if len(ids) == 0:
+            return None
+        trader_id = ids[int(rng.random() * len(ids))]
+        return trader_id, self.offers[trader_id][1]
+
+    def num_offers(self, offer_type):
+        return len(self.ids[offer_type])
+
+
+class OrderBookView(object):
+    """Read-only view of an OrderBook given to agents
+
+       Also supports the old dictionary style access:
+       iterating gives trader_ids with standing offers and
+       view[trader_id] gives (type, amount) or None
+    """
+    __slots__ = ("book",)
+
+    def __init__(self, book):
+        self.book = book
+
+    def best_bid(self):
+        """Returns (trader_id, amount) of highest bid or None"""
+        return self.book.best_bid()
+
+    def best_ask(self):
+        """Returns (trader_id, amount) of lowest ask or None"""
+        return self.book.best_ask()
+
+    def random_bid(self, rng):
+        """Returns (trader_id, amount) of a random bid or None"""
+        return self.book.random_offer("BID", rng)
+
+    def random_ask(self, rng):
+        """Returns (trader_id, amount) of a random ask or None"""
+        return self.book.random_offer("ASK", rng)
+
+    def num_bids(self):
+        return self.book.num_offers("BID")
+
+    def num_asks(self):
+        return self.book.num_offers("ASK")
+
+    def get(self, trader_id):
+        return self.book.get(trader_id)
+
+    def __getitem__(self, trader_id):
+        return self.book.get(trader_id)
+
+    def __iter__(self):
+        return iter(list(self.book.offers))
+
+    def __len__(self):
+        return len(self.book.offers)
@@ -1,15 +1,38 @@
-import random as rnd
+import numpy as np
 from institutions.dm_message_model import Message
 
 class Travel(object):
-    """Travel Institution"""
+    """Travel Institution
+
+       self.grid is an occupancy index kept up to date as agents move,
+       with counts of buyers and sellers at each location so locations
+       where bargaining is possible can be listed without scanning agents.
+
+       With active_only, traders passed to deactivate (those with no units
+       left) stay in self.grid but are dropped from self.active, so they
+       are not asked to move and are not counted as buyers or sellers.
+
+       restrictions (see dm_events.EventState) may be changed between
+       periods: moves into restrictions.closed_cells and moves by traders
+       named in restrictions.frozen are refused like moves off the grid.
+    """
     
-    def __init__(self, grid_dimension, agents, debug_flag=False):
+    def __init__(self, grid_dimension, agents, debug_flag=False, fast_dispatch=False,
+                 rng=None, active_only=False, restrictions=None):
         self.grid_dimension = grid_dimension  # determines dimensions of a square grid  
         self.agents = agents  # list of agent objects
         self.grid = {}  #grid is a dictionary indexed by location (x,y)
+        self.num_buyers = {}   # number of BUYERs at location
+        self.num_sellers = {}  # number of SELLERs at location
+        self.matched = {}      # locations with a buyer and a seller, in order matched
+        self.active_only = active_only
+        self.active = self.grid  # active agents by location, the grid itself unless active_only
+        self.inactive = set()    # names of deactivated agents
         self.history = {}
         self.debug = debug_flag
+        self.fast_dispatch = fast_dispatch  # if True call agent.request_move directly
+        self.rng = rng if rng is not None else np.random.default_rng()  # shuffles move order
+        self.restrictions = restrictions  # closed cells and frozen traders, None = no limits
  
     def start_travel(self):
         self.setup_agents_history()
@@ -24,43 +47,129 @@ class Travel(object):
          
     def locate_agents(self):
         """Put agents in grid"""
+        self.grid = {}
+        self.active = {} if self.active_only else self.grid
+        self.inactive = set()
+        self.num_buyers = {}
+        self.num_sellers = {}
+        self.matched = {}
         for agent in self.agents:
-            loc = agent.get_location()
-            if loc in self.grid.keys():
-                self.grid[loc].append(agent) # add agent to list of agents at loc
-            else:
-                self.grid[loc] = [agent]  # start a list of agents
-        
+            self.add_agent(agent, agent.get_location())
+
+    def add_agent(self, agent, loc):
+        """Add agent to occupancy index at loc"""
+        if loc in self.grid:
+            self.grid[loc].append(agent) # add agent to list of agents at loc
+        else:
+            self.grid[loc] = [agent]  # start a list of agents
+            self.num_buyers[loc] = 0
+            self.num_sellers[loc] = 0
+        if agent.name in self.inactive:
+            return
+        if self.active is not self.grid:
+            self.active.setdefault(loc, []).append(agent)
+        self.count_agent(agent, loc, 1)
+
+    def remove_agent(self, agent, loc):
+        """Remove agent from occupancy index at loc"""
+        agents_at = self.grid[loc]
+        agents_at.remove(agent)
+        if agent.name not in self.inactive:
+            self.remove_active(agent, loc)
+        if len(agents_at) == 0:
+            del self.grid[loc]
+            del self.num_buyers[loc]
+            del self.num_sellers[loc]
+            self.matched.pop(loc, None)
+
+    def remove_active(self, agent, loc):
+        """Remove agent from the active index and the counts at loc"""
+        if self.active is not self.grid:
+            active_at = self.active[loc]
+            active_at.remove(agent)
+            if len(active_at) == 0:
+                del self.active[loc]
+        self.count_agent(agent, loc, -1)
+
+    def count_agent(self, agent, loc, change):
+        """Change buyer or seller count at loc and keep self.matched up to date"""
+        if agent.type == "BUYER":
+            self.num_buyers[loc] += change
+        else:
+            self.num_sellers[loc] += change
+        if self.num_buyers[loc] > 0 and self.num_sellers[loc] > 0:
+            self.matched[loc] = True
+        elif loc in self.matched:
+            del self.matched[loc]
+
+    def deactivate(self, agent):
+        """Drop agent from travel and bargaining until locate_agents, needs active_only"""
+        if agent.name in self.inactive:
+            return
+        self.remove_active(agent, agent.get_location())
+        self.inactive.add(agent.name)
+
+    def get_active_grid(self):
+        """Returns dictionary location -> list of active agents"""
+        return self.active
+
+    def get_num_active(self):
+        return len(self.agents) - len(self.inactive)
+
     def get_grid(self):
         return self.grid
 
+    def get_matched_locations(self):
+        """Returns list of locations with at least one buyer and one seller"""
+        return list(self.matched)
+
     def set_debug(self, debug):
         self.debug = debug 
+
+    def set_fast_dispatch(self, flag):
+        self.fast_dispatch = flag
+
+    def request_move(self, agent):
+        """Returns (directive, payload) for agent's MOVE"""
+        if self.fast_dispatch:
+            return "MOVE", agent.request_move()
+        msg = Message('MOVE_REQUESTED', 'TRAVEL', agent.get_name(), "  ")
+        return_msg = agent.process_message(msg)
+        return return_msg.get_directive(), return_msg.get_payload()
     
     def run(self):
-        for point in self.grid:
-            agent_order =[]
-            for agent in self.grid[point]:
-                agent_order.append(agent)
-            rnd.shuffle(agent_order)
+        restrictions = self.restrictions
+        closed = restrictions.closed_cells if restrictions is not None else ()
+        frozen = restrictions.frozen if restrictions is not None else ()
+        # moves update self.grid, so walk a snapshot of every location's members
+        # taken before anyone moves: a trader moving into a location not yet
+        # visited must not be asked to move again this period.
+        # num_at_loc counts every agent at point, active or not
+        snapshot = [(point, list(agents_at), len(self.grid[point]))
+                    for point, agents_at in self.active.items()]
+        for point, agent_order, num_at_loc in snapshot:
+            self.rng.shuffle(agent_order)
             for agent in agent_order:
-                agent.set_num_at_loc(len(agent_order))
-                msg = Message('MOVE_REQUESTED', 'TRAVEL', agent.get_name(), "  ")
-                return_msg = agent.process_message(msg)
-                if return_msg.get_directive() == "MOVE":
-                    x_dir, y_dir = return_msg.get_payload()
+                agent.set_num_at_loc(num_at_loc)
+                directive, payload = self.request_move(agent)
+                if directive == "MOVE":
+                    x_dir, y_dir = payload
                     loc = agent.get_location()
                     # debug message
                     if self.debug:
                         print(f"Travel -> agent {agent.name} at {loc} moves ({x_dir, y_dir})" +
                           "to ", end = "")
                     if 0 <= loc[0] + x_dir and loc[0] + x_dir <= self.grid_dimension - 1:
-                        if 0 <= loc[1] + y_dir and loc[1] + y_dir <= self.grid_dimension - 1:
-                            location = loc[0] + x_dir, loc[1] + y_dir
+                        location = loc[0] + x_dir, loc[1] + y_dir
+                        if (0 <= loc[1] + y_dir and loc[1] + y_dir <= self.grid_dimension - 1
+                                and location not in closed and agent.name not in frozen):
                             if self.debug:
                                 print("move good", location)
                             agent.set_location(location)
                             self.history[agent.name].append(location)
+                            if location != loc:
+                                self.remove_agent(agent, loc)
+                                self.add_agent(agent, location)
                         else:
                             agent.set_location(loc)
                             self.history[agent.name].append(loc)
@@ -71,8 +180,6 @@ class Travel(object):
                         self.history[agent.name].append(loc)
                         if self.debug:
                             print("move bad", loc)
-        self.grid = {}
-        self.locate_agents()
                
     def print_grid(self):
         for x in range(self.grid_dimension):
@@ -0,0 +1,384 @@
+import numpy as np
+import environment.dm_agents as dm_agents
+from simulations.dm_perf import PeriodPerf, clock
+
+# Strategy flags used by the array engine: (affinity, optimizing, repulsion)
+#   affinity   = stay put after a contract (ZIDA, ZIDPA, ZIDPR)
+#   optimizing = accept best standing offer instead of a random one (ZIDP family)
+#   repulsion  = move away from locations with more than two traders (ZIDPR)
+STRATEGY_FLAGS = {
+    dm_agents.ZID: (False, False, False),
+    dm_agents.ZIDA: (True, False, False),
+    dm_agents.ZIDP: (False, True, False),
+    dm_agents.ZIDPA: (True, True, False),
+    dm_agents.ZIDPR: (True, True, True),
+}
+
+
+class ArraySimPeriod(object):
+    """Struct-of-arrays engine for one period of a decentralized market.
+
+       Drop in replacement for SimPeriod when every trader uses one of the
+       strategies in STRATEGY_FLAGS.  Trader state (values/costs, cur_unit,
+       location, strategy flags) is held in NumPy arrays and travel, offers
+       and matching run as array operations vectorized across grid cells.
+       Results match the object engine statistically, not draw for draw.
+
+       Trader state is loaded when the object is built and written back to the
+       trader objects after every period, so make_sim can keep building one
+       engine per week after calling agent.start().
+    """
+
+    def __init__(self, sim_name, num_rounds, agents, market, grid_size,
+                 debug=False, plot_on=False, rng=None, perf=False):
+
+        self.sim_name = sim_name            # simulation name
+        self.num_rounds = num_rounds        # number of bargaining rounds for a day
+        self.agent_list = agents            # trader objects
+        self.market = market                # market environment object
+        self.grid_size = grid_size          # simulation grid size: square
+        self.debug = debug                  # if True print additional information
+        self.plot_on = plot_on              # kept for SimPeriod compatibility
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.perf = PeriodPerf() if perf else None  # phase timing and counts, None = off
+        self.period_results = {}            # period simulation results
+        self.prices = []                    # list_of_prices
+        self.contracts = None               # list of contract tuples, built on request
+        self.contract_rows = np.zeros((0, 8), dtype=np.int64)  # contracts for ContractLog
+
+        # running totals over every period run since this object was built
+        self.buyer_surplus = 0      # Sum of (value-price)
+        self.seller_surplus = 0     # Sum of (price-cost)
+        self.actual_surplus = 0     # Sum of buyer surplus and seller surplus
+        self.type_surplus = {}      # surplus accrued by trader type
+
+        self.load_agents()
+
+    def load_agents(self):
+        """Copy trader objects into arrays"""
+        agents = self.agent_list
+        n = len(agents)
+        self.names = [agent.get_name() for agent in agents]
+        strategies = [agent.strategy for agent in agents]
+        self.strategy_names = list(dict.fromkeys(strategies))
+        self.strategy_index = np.array([self.strategy_names.index(strategy)
+                                        for strategy in strategies], dtype=np.int64)
+        self.type_surplus = {strategy: 0 for strategy in self.strategy_names}
+        self.is_buyer = np.array([agent.get_type() == "BUYER" for agent in agents], dtype=bool)
+
+        # reservation values: values for buyers, costs for sellers, padded to max units
+        res_lists = [agent.get_values() if buyer else agent.get_costs()
+                     for agent, buyer in zip(agents, self.is_buyer)]
+        self.num_units = np.array([len(res) for res in res_lists], dtype=np.int64)
+        max_units = int(self.num_units.max()) if n > 0 else 0
+        self.res = np.zeros((n, max(max_units, 1)), dtype=np.int64)
+        for k, res in enumerate(res_lists):
+            self.res[k, :len(res)] = res
+
+        self.lower_bound = np.array([agent.lower_bound for agent in agents], dtype=np.int64)
+        self.upper_bound = np.array([agent.upper_bound for agent in agents], dtype=np.int64)
+        self.cur_unit = np.array([agent.get_cur_unit() for agent in agents], dtype=np.int64)
+        self.units_transacted = np.array([agent.get_units_transacted() for agent in agents],
+                                         dtype=np.int64)
+        locations = [agent.get_location() for agent in agents]
+        self.x = np.array([loc[0] for loc in locations], dtype=np.int64)
+        self.y = np.array([loc[1] for loc in locations], dtype=np.int64)
+        self.contracted = np.array([agent.contract_this_period for agent in agents], dtype=bool)
+
+        flags = []
+        for agent in agents:
+            if type(agent) not in STRATEGY_FLAGS:
+                raise ValueError(f"array engine does not support strategy {type(agent).__name__}")
+            flags.append(STRATEGY_FLAGS[type(agent)])
+        flags = np.array(flags, dtype=bool).reshape(n, 3)
+        self.affinity = flags[:, 0]
+        self.optimizing = flags[:, 1]
+        self.repulsion = flags[:, 2]
+
+    def store_agents(self):
+        """Write array state back to trader objects"""
+        for k, agent in enumerate(self.agent_list):
+            agent.cur_unit = int(self.cur_unit[k])
+            agent.units_transacted = int(self.units_transacted[k])
+            agent.set_location((int(self.x[k]), int(self.y[k])))
+            agent.set_contract_this_period(bool(self.contracted[k]))
+
+    def travel(self):
+        """Move every trader one step, mirroring Travel.run and move_requested"""
+        n = len(self.agent_list)
+        g = self.grid_size
+        cell = self.x * g + self.y
+        num_at_loc = np.bincount(cell, minlength=g * g)[cell]
+
+        # ZID resets its contract flag when asked to move, affinity strategies do not
+        self.contracted[~self.affinity] = False
+        exhausted = self.cur_unit >= self.num_units  # traders with no units left stay put
+        stay = (self.affinity & self.contracted) | exhausted
+        dx = self.rng.integers(-1, 2, size=n)
+        dy = self.rng.integers(-1, 2, size=n)
+        dx[stay] = 0
+        dy[stay] = 0
+
+        # ZIDPR leaves crowded locations: direction drawn from [-1, +1]
+        crowded = self.repulsion & (num_at_loc > 2) & ~exhausted
+        num_crowded = int(crowded.sum())
+        if num_crowded > 0:
+            dx[crowded] = 2 * self.rng.integers(0, 2, size=num_crowded) - 1
+            dy[crowded] = 2 * self.rng.integers(0, 2, size=num_crowded) - 1
+
+        # a move off the grid leaves the trader where it is
+        new_x = self.x + dx
+        new_y = self.y + dy
+        ok = (new_x >= 0) & (new_x < g) & (new_y >= 0) & (new_y < g)
+        self.x = np.where(ok, new_x, self.x)
+        self.y = np.where(ok, new_y, self.y)
+
+    def matched_cells(self):
+        """Returns (agent indices in cells with a buyer and a seller, cell of each)"""
+        g = self.grid_size
+        cell = self.x * g + self.y
+        num_buyers = np.bincount(cell[self.is_buyer], minlength=g * g)
+        num_sellers = np.bincount(cell[~self.is_buyer], minlength=g * g)
+        matched = (num_buyers > 0) & (num_sellers > 0)
+        members = np.flatnonzero(matched[cell])
+        return members, cell[members]
+
+    def draw_reservation_offers(self, idx):
+        """Draw WTP for buyers and WTA for sellers in idx at their current unit"""
+        unit_res = self.res[idx, self.cur_unit[idx]]
+        buyer = self.is_buyer[idx]
+        low = np.where(buyer, self.lower_bound[idx], unit_res)
+        high = np.where(buyer, unit_res, self.upper_bound[idx])
+        return self.rng.integers(low, high + 1)
+
+    def bargain(self):
+        """Run self.num_rounds of bargaining in every matched cell at once
+
+           Offer phase: every trader with units left posts a bid or ask.
+           Transact phase: traders in each cell act in shuffled order.  Step k
+           lets the k-th trader of every cell act, so the loop runs over the
+           largest cell population while each step is vectorized over cells.
+        """
+        members, member_cell = self.matched_cells()
+        contracts = []   # list of arrays, one row per contract
+        if len(members) == 0:
+            return np.zeros((0, 9), dtype=np.int64)
+
+        # renumber cells 0..num_cells-1 in order of first appearance
+        cells, cell_index = np.unique(member_cell, return_inverse=True)
+        num_cells = len(cells)
+        n = len(self.agent_list)
+        agent_cell = np.full(n, -1, dtype=np.int64)
+        agent_cell[members] = cell_index
+
+        offer_price = np.zeros(n, dtype=np.int64)
+        offer_live = np.zeros(n, dtype=bool)
+
+        for round_number in range(self.num_rounds):
+            # offer phase
+            offer_live[:] = False
+            posting = members[self.cur_unit[members] < self.num_units[members]]
+            if len(posting) == 0:
+                break
+            offer_price[posting] = self.draw_reservation_offers(posting)
+            offer_live[posting] = True
+
+            # segment offers by (cell, side): side 0 = bids, 1 = asks
+            # best offer first: bids high to low, asks low to high
+            side = (~self.is_buyer[posting]).astype(np.int64)
+            seg_of_posting = agent_cell[posting] * 2 + side
+            rank_price = np.where(side == 1, offer_price[posting], -offer_price[posting])
+            order = np.lexsort((self.rng.random(len(posting)), rank_price, seg_of_posting))
+            seg_sorted = posting[order]
+            seg_len = np.bincount(seg_of_posting, minlength=2 * num_cells)
+            seg_start = np.concatenate(([0], np.cumsum(seg_len)[:-1]))
+            seg_live = seg_len.copy()
+            seg_ptr = np.zeros(2 * num_cells, dtype=np.int64)  # first possibly live best offer
+            offer_seg = np.full(n, -1, dtype=np.int64)
+            offer_seg[posting] = seg_of_posting
+
+            # transact phase: shuffled order within each cell
+            order = np.lexsort((self.rng.random(len(members)), cell_index))
+            acting = members[order]
+            acting_cell = cell_index[order]
+            first = np.searchsorted(acting_cell, np.arange(num_cells))
+            step_of = np.arange(len(acting)) - first[acting_cell]
+
+            for step in range(int(step_of.max()) + 1):
+                actors = acting[step_of == step]
+                actors = actors[self.cur_unit[actors] < self.num_units[actors]]
+                if len(actors) == 0:
+                    continue
+                bid_ask = self.draw_reservation_offers(actors)
+                buyer = self.is_buyer[actors]
+                seg = agent_cell[actors] * 2 + buyer.astype(np.int64)  # opposite side
+                has_offer = seg_live[seg] > 0
+                actors, bid_ask, buyer, seg = (actors[has_offer], bid_ask[has_offer],
+                                               buyer[has_offer], seg[has_offer])
+                if len(actors) == 0:
+                    continue
+
+                chosen = np.empty(len(actors), dtype=np.int64)
+                best = self.optimizing[actors]
+                if best.any():
+                    chosen[best] = self.best_offer(seg[best], seg_sorted, seg_start,
+                                                   seg_ptr, offer_live)
+                if (~best).any():
+                    chosen[~best] = self.random_offer(seg[~best], seg_sorted, seg_start,
+                                                      seg_len, offer_live)
+
+                price = offer_price[chosen]
+                accept = np.where(buyer, bid_ask >= price, bid_ask <= price)
+                if not accept.any():
+                    continue
+                actors, chosen, buyer, price = (actors[accept], chosen[accept],
+                                                buyer[accept], price[accept])
+                buyers = np.where(buyer, actors, chosen)
+                sellers = np.where(buyer, chosen, actors)
+
+                b_cur = self.cur_unit[buyers]
+                s_cur = self.cur_unit[sellers]
+                contracts.append(np.column_stack((
+                    agent_cell[buyers], np.full(len(buyers), round_number), price,
+                    buyers, sellers, b_cur, self.res[buyers, b_cur],
+                    s_cur, self.res[sellers, s_cur])))
+
+                # cancel both parties' offers and update units
+                for party in (buyers, sellers):
+                    live = party[offer_live[party]]
+                    np.subtract.at(seg_live, offer_seg[live], 1)
+                    offer_live[party] = False
+                    self.cur_unit[party] += 1
+                    self.units_transacted[party] += 1
+                    self.contracted[party] = True
+
+        if len(contracts) == 0:
+            return np.zeros((0, 9), dtype=np.int64)
+        contracts = np.concatenate(contracts)
+        # group by cell as the object engine does, keeping round order within a cell
+        return contracts[np.argsort(contracts[:, 0], kind="stable")]
+
+    def best_offer(self, seg, seg_sorted, seg_start, seg_ptr, offer_live):
+        """Returns the best live offer in each segment of seg"""
+        while True:
+            chosen = seg_sorted[seg_start[seg] + seg_ptr[seg]]
+            dead = ~offer_live[chosen]
+            if not dead.any():
+                return chosen
+            seg_ptr[seg[dead]] += 1
+
+    def random_offer(self, seg, seg_sorted, seg_start, seg_len, offer_live, tries=8):
+        """Returns a uniformly chosen live offer in each segment of seg"""
+        chosen = np.full(len(seg), -1, dtype=np.int64)
+        todo = np.arange(len(seg))
+        for attempt in range(tries):
+            s = seg[todo]
+            pick = seg_sorted[seg_start[s] + self.rng.integers(0, seg_len[s])]
+            live = offer_live[pick]
+            chosen[todo[live]] = pick[live]
+            todo = todo[~live]
+            if len(todo) == 0:
+                return chosen
+        # segments that are mostly cancelled: choose among the live offers directly
+        for k in todo:
+            start = seg_start[seg[k]]
+            candidates = seg_sorted[start:start + seg_len[seg[k]]]
+            candidates = candidates[offer_live[candidates]]
+            chosen[k] = candidates[self.rng.integers(0, len(candidates))]
+        return chosen
+
+    def run_period(self):
+        """ Runs a simulation for a period:
+                agents make travel decisions
+                make contracts with agents at the same node"""
+        perf = self.perf
+        if perf is not None:
+            start = clock()
+        self.travel()
+        if perf is not None:
+            travel_done = clock()
+            perf.add_time('travel', travel_done - start)
+        rows = self.bargain()  # matching is vectorized into bargaining
+        if perf is not None:
+            bargain_done = clock()
+            perf.add_time('bargain', bargain_done - travel_done)
+        self.store_agents()
+        self.add_surplus(rows)
+
+        # drop the cell column, trader ids are indexes into self.agent_list
+        self.contract_rows = rows[:, 1:]
+        self.contracts = None
+
+        # save results
+        self.period_results = {}
+        self.prices = self.contract_rows[:, 1].tolist()
+
+        if perf is not None:
+            perf.add_time('bookkeeping', clock() - bargain_done)
+            perf.count('periods')
+            perf.count('moves', len(self.agent_list))
+            perf.count('rounds', self.num_rounds)
+            perf.count('contracts', len(rows))
+
+    def get_perf(self):
+        """Returns phase times and counts since this object was built, None when off
+           cells_bargained and requests_bound are not counted by this engine
+        """
+        if self.perf is None:
+            return None
+        return self.perf.get_results()
+
+    def add_surplus(self, rows):
+        """Adds surplus from contract rows made this period to the running totals"""
+        price = rows[:, 2]
+        b_surplus = rows[:, 6] - price
+        s_surplus = price - rows[:, 8]
+        self.buyer_surplus += int(b_surplus.sum())
+        self.seller_surplus += int(s_surplus.sum())
+        self.actual_surplus = self.buyer_surplus + self.seller_surplus
+        by_type = np.zeros(len(self.strategy_names), dtype=np.int64)
+        np.add.at(by_type, self.strategy_index[rows[:, 3]], b_surplus)
+        np.add.at(by_type, self.strategy_index[rows[:, 4]], s_surplus)
+        for k, strategy in enumerate(self.strategy_names):
+            self.type_surplus[strategy] += int(by_type[k])
+
+    def get_surplus(self):
+        """Returns running buyer_surplus, seller_surplus, type_surplus"""
+        return self.buyer_surplus, self.seller_surplus, self.type_surplus
+
+    def get_contracts(self):
+        """Returns contracts for the last period as extended contract tuples"""
+        if self.contracts is None:
+            names = self.names
+            self.contracts = [(round_number, price, names[buyer], names[seller],
+                               b_cur, b_val, s_cur, s_cost)
+                              for round_number, price, buyer, seller, b_cur, b_val, s_cur, s_cost
+                              in self.contract_rows.tolist()]
+            self.period_results["contracts"] = self.contracts
+        return self.contracts
+
+    def get_contract_rows(self):
+        """Returns contracts for the last period as an integer array with columns
+           dm_contract_log.ROW_FIELDS, trader ids index self.agent_list
+        """
+        return self.contract_rows
+
+    def get_prices(self):
+        return self.prices
+
+    def get_agents(self):
+        return self.agent_list
+
+    def get_name(self):
+        return self.sim_name
+
+    def get_cells(self):
+        """Returns cell ids x * grid_size + y indexed by trader id, see dm_grid_log.GridLog"""
+        return self.x * self.grid_size + self.y
+
+    def get_grid(self):
+        """Returns dictionary s_grid[loc] = list of agent names at loc"""
+        s_grid = {}
+        for name, x, y in zip(self.names, self.x.tolist(), self.y.tolist()):
+            s_grid.setdefault((x, y), []).append(name)
+        return s_grid
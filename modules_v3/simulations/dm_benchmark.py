@@ -0,0 +1,241 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np                              # import numpy
+
+import environment.dm_agents as dm_agents
+import environment.env_make_agents as mkt
+import institutions.dm_bargain as dm_bargain
+import institutions.dm_travel as dm_travel
+import simulations.dm_sim as dm_sim
+import dm_process_results as pr
+
+# parameters every benchmark starts from, a sweep changes one of them at a time
+BASE_PARMS = {'num_traders': 20, 'grid_size': 4, 'num_rounds': 5, 'num_units': 8,
+              'num_periods': 7, 'lower_bound': 200, 'upper_bound': 600,
+              'engine': 'object', 'fast_dispatch': False, 'seed': 0}
+
+# sweeps: parameter -> values tried with the other parameters at BASE_PARMS
+SWEEPS = {
+    'quick': {'num_traders': [20, 100, 400],
+              'grid_size': [4, 15, 50],
+              'num_rounds': [5, 15, 60]},
+    'full': {'num_traders': [20, 100, 1000, 10000],
+             'grid_size': [4, 15, 50, 500],
+             'num_rounds': [5, 15, 30, 60]},
+}
+
+
+def make_agents(parms, rng):
+    """Returns agents and market for parms, half ZID half ZIDA"""
+    num_traders = parms['num_traders']
+    trader_objects = [(dm_agents.ZID, num_traders // 2),
+                      (dm_agents.ZIDA, num_traders - num_traders // 2)]
+    agent_maker = mkt.MakeAgents(num_traders, trader_objects, parms['num_units'],
+                                 parms['grid_size'], parms['lower_bound'],
+                                 parms['upper_bound'], rng=rng)
+    agent_maker.make_agents()
+    agent_maker.set_locations(parms['grid_size'])
+    agents = agent_maker.get_agents()
+    agent_maker.make_market('benchmark')
+    for agent in agents:
+        agent.start(None)
+    return agents, agent_maker.get_market()
+
+
+def make_period_engine(parms, agents, market, rng):
+    """Returns the period engine parms['engine'] selects, see dm_sim.ENGINES"""
+    engine_options = {'rng': rng}
+    if parms['engine'] == 'object':
+        engine_options['fast_dispatch'] = parms['fast_dispatch']
+    return dm_sim.ENGINES[parms['engine']]('benchmark', parms['num_rounds'], agents, market,
+                                           parms['grid_size'], **engine_options)
+
+
+# Each setup_* builds everything an operation needs and returns the
+# operation as a function of no arguments.  Only the operation is timed.
+
+def setup_bargain(parms, rng):
+    """Bargain.run with every trader at one location"""
+    agents, market = make_agents(parms, rng)
+    bargain = dm_bargain.Bargain(parms['num_rounds'], parms['fast_dispatch'], rng)
+    bargain.set_agents(agents)
+    return bargain.run
+
+
+def setup_travel(parms, rng):
+    """Travel.run for every trader on the grid"""
+    agents, market = make_agents(parms, rng)
+    travel = dm_travel.Travel(parms['grid_size'], agents, False, parms['fast_dispatch'], rng)
+    travel.start_travel()
+    return travel.run
+
+
+def setup_run_period(parms, rng):
+    """run_period of parms['engine'], travel then bargaining at every matched location"""
+    agents, market = make_agents(parms, rng)
+    return make_period_engine(parms, agents, market, rng).run_period
+
+
+def setup_calc_efficiency(parms, rng):
+    """ProcessResults.calc_efficiency over the contracts of num_periods periods"""
+    agents, market = make_agents(parms, rng)
+    sim = make_period_engine(parms, agents, market, rng)
+    contracts = []
+    for period in range(parms['num_periods']):
+        sim.run_period()
+        contracts.extend(sim.get_contracts())
+    results = pr.ProcessResults(market, 'benchmark', agents, contracts)
+    return results.calc_efficiency
+
+
+def setup_calc_equilibrium(parms, rng):
+    """SpotMarketEnvironment.calc_equilibrium for the traders' values and costs"""
+    agents, market = make_agents(parms, rng)
+    return market.calc_equilibrium
+
+
+def setup_make_sim_week(parms, rng):
+    """make_sim for one week of num_periods periods, from agents and market
+       built beforehand (dm_sim.make_setup), so their making is not timed
+    """
+    trader_objects = [(dm_agents.ZID, parms['num_traders'] // 2),
+                      (dm_agents.ZIDA, parms['num_traders'] - parms['num_traders'] // 2)]
+    seed = int(rng.integers(2**32))
+    setup = dm_sim.make_setup('benchmark', parms['grid_size'], parms['num_traders'],
+                              parms['num_units'], parms['lower_bound'], parms['upper_bound'],
+                              trader_objects, seed)
+
+    def make_sim_week():
+        dm_sim.make_sim('benchmark', parms['num_periods'], 1,
+                        parms['num_rounds'], parms['grid_size'],
+                        parms['num_traders'], parms['num_units'],
+                        parms['lower_bound'], parms['upper_bound'],
+                        trader_objects, parms['engine'], parms['fast_dispatch'], seed,
+                        setup=setup)
+    return make_sim_week
+
+
+BENCHMARKS = {
+    'bargain_run': setup_bargain,
+    'travel_run': setup_travel,
+    'run_period': setup_run_period,
+    'calc_efficiency': setup_calc_efficiency,
+    'calc_equilibrium': setup_calc_equilibrium,
+    'make_sim_week': setup_make_sim_week,
+}
+
+
+def time_benchmark(name, parms, repeat=3):
+    """Runs benchmark name repeat times with a fresh setup each time
+       returns dictionary with min and mean seconds per operation and
+       peak memory in bytes allocated by one more run under tracemalloc
+    """
+    setup = BENCHMARKS[name]
+    rng = np.random.default_rng(parms['seed'])
+    times = []
+    for k in range(repeat):
+        operation = setup(parms, rng)
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+
+    # memory is measured separately, tracemalloc slows the operation down
+    operation = setup(parms, rng)
+    tracemalloc.start()
+    operation()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'benchmark': name, 'parms': dict(parms), 'repeat': repeat,
+            'time_min': min(times), 'time_mean': sum(times) / repeat,
+            'peak_memory': peak}
+
+
+def run_suite(sweep='quick', benchmarks=None, repeat=3, base_parms=None, verbose=True):
+    """Runs each benchmark over SWEEPS[sweep] and returns results table
+       benchmarks = list of names in BENCHMARKS, default all
+    """
+    base = dict(BASE_PARMS if base_parms is None else base_parms)
+    names = list(BENCHMARKS) if benchmarks is None else benchmarks
+    results = []
+    for name in names:
+        for parm, values in SWEEPS[sweep].items():
+            for value in values:
+                parms = dict(base)
+                parms[parm] = value
+                result = time_benchmark(name, parms, repeat)
+                result['sweep'] = parm
+                results.append(result)
+                if verbose:
+                    print(f"{name:18} {parm:12} {value:>6}  "
+                          f"{result['time_min']:10.5f} s  {result['peak_memory']/1e6:9.2f} MB")
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                     'platform': platform.platform(), 'sweep': sweep, 'repeat': repeat,
+                     'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+            'results': results}
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def result_key(result):
+    """Key matching the same benchmark and parameters in two result tables"""
+    return result['benchmark'], json.dumps(result['parms'], sort_keys=True)
+
+
+def compare_results(baseline, current, threshold=1.10):
+    """Returns list of (benchmark, sweep, value, time ratio, memory ratio, regressed)
+       for results in both tables, ratio = current / baseline and
+       regressed = True when time_min grew by more than threshold
+    """
+    base_results = {result_key(result): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        base = base_results.get(result_key(result))
+        if base is None:
+            continue
+        time_ratio = result['time_min'] / base['time_min'] if base['time_min'] else float('inf')
+        memory_ratio = result['peak_memory'] / base['peak_memory'] if base['peak_memory'] else float('inf')
+        sweep = result['sweep']
+        rows.append((result['benchmark'], sweep, result['parms'][sweep],
+                     time_ratio, memory_ratio, time_ratio > threshold))
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'benchmark':18} {'sweep':12} {'value':>6}  {'time':>7}  {'memory':>7}")
+    for name, sweep, value, time_ratio, memory_ratio, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:18} {sweep:12} {value:>6}  {time_ratio:7.2f}  {memory_ratio:7.2f}{flag}")
+
+
+if __name__ == "__main__":
+    # python -m simulations.dm_benchmark --sweep quick --out bench.json --baseline base.json
+
+    parser = argparse.ArgumentParser(description='Benchmark simulation hot paths')
+    parser.add_argument('--sweep', default='quick', choices=list(SWEEPS))
+    parser.add_argument('--benchmarks', nargs='*', choices=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engine', default=BASE_PARMS['engine'], choices=list(dm_sim.ENGINES))
+    parser.add_argument('--fast-dispatch', action='store_true')
+    parser.add_argument('--out', help='save results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    args = parser.parse_args()
+
+    base_parms = dict(BASE_PARMS, engine=args.engine, fast_dispatch=args.fast_dispatch)
+    results = run_suite(args.sweep, args.benchmarks, args.repeat, base_parms)
+    if args.out:
+        save_results(results, args.out)
+    if args.baseline:
+        print()
+        print_comparison(compare_results(load_results(args.baseline), results))
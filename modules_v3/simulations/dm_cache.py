@@ -0,0 +1,212 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import numpy as np                              # import numpy
+
+import simulations.dm_sim as dm_sim
+
+# bump when the layout of make_sim data changes, or when engine code the key
+# does not cover (Bargain, Travel, the period engines, rand_int) changes results
+CACHE_VERSION = 1
+
+# make_sim parameters that bypass the cache unless None
+UNCACHED_PARMS = ('offer_history', 'events', 'snapshot', 'checkpoint_path', 'setup')
+
+
+def code_text(code):
+    """Returns text of a code object's bytecode, constants and names,
+       nested code objects (comprehensions, inner functions) included
+    """
+    consts = [code_text(const) if inspect.iscode(const) else repr(const)
+              for const in code.co_consts]
+    return f"{code.co_code.hex()} {consts} {code.co_names}"
+
+
+def class_code(cls):
+    """Returns text of the code of every method defined in cls, for classes
+       whose source inspect cannot find (notebook cells, exec)
+    """
+    parts = [cls.__qualname__]
+    for name, value in sorted(cls.__dict__.items()):
+        value = getattr(value, '__func__', value)  # staticmethod, classmethod
+        if inspect.isfunction(value):
+            parts.append(f"{name} {code_text(value.__code__)}")
+    return '\n'.join(parts)
+
+
+def strategy_identity(trader_class):
+    """Returns name and source hash of trader_class and the classes it inherits,
+       so editing a strategy invalidates results cached with it; classes
+       without source are hashed by their methods' code instead
+       Only strategy code is hashed, see CACHE_VERSION for engine code.
+    """
+    sources = []
+    for cls in trader_class.__mro__:
+        if cls is object:
+            continue
+        try:
+            sources.append(inspect.getsource(cls))
+        except (OSError, TypeError):
+            sources.append(class_code(cls))
+    source_hash = hashlib.sha256('\n'.join(sources).encode()).hexdigest()[:16]
+    return f"{trader_class.__module__}.{trader_class.__qualname__}", source_hash
+
+
+def seed_identity(seed):
+    """Returns a json-able description of an int or SeedSequence seed"""
+    if isinstance(seed, np.random.SeedSequence):
+        return {'entropy': str(seed.entropy), 'spawn_key': list(seed.spawn_key)}
+    return seed
+
+
+class SimCache(object):
+    """Content-addressed on-disk cache of make_sim results
+
+       Results are stored one pickle file per key, the key a hash of every
+       make_sim parameter, the trader strategy identities and the seed.
+       Reading a result touches its file, and when the cache grows past
+       max_bytes the least recently used results are removed.
+    """
+
+    def __init__(self, path, max_bytes=2 * 2**30):
+        self.path = path            # cache directory
+        self.max_bytes = max_bytes  # cache size bound
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def make_key(self, parms):
+        """Returns hash of make_sim parms (dictionary of bound make_sim arguments)
+           Raises TypeError on a value that has no json form, rather than
+           hashing a repr that may differ from run to run.
+        """
+        parms = dict(parms)
+        parms['trader_objects'] = [(strategy_identity(trader), num)
+                                   for trader, num in parms['trader_objects']]
+        parms['seed'] = seed_identity(parms['seed'])
+        # results depend on whether locations bargain in parallel, not on the worker count
+        parms['bargain_workers'] = parms.get('bargain_workers') is not None
+        parms['cache_version'] = CACHE_VERSION
+        text = json.dumps(parms, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def file_name(self, key):
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def get(self, key):
+        """Returns cached data for key or None"""
+        file_name = self.file_name(key)
+        try:
+            with open(file_name, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(file_name)  # most recently used
+        return data
+
+    def put(self, key, data):
+        file_name = self.file_name(key)
+        with open(file_name + '.tmp', 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file_name + '.tmp', file_name)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used results until the cache fits in max_bytes"""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, file_name in entries)
+        for mtime, size, file_name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(file_name)
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.pkl'):
+                os.remove(entry.path)
+
+    def sim_key(self, args, kwargs):
+        """Returns the key of make_sim(*args, **kwargs), None if it is not cached
+
+           Runs without seed or with an offer_history are not cached, the
+           first is not repeatable and the second records offers as it runs.
+           Nor are runs given events, a snapshot, a checkpoint_path or a
+           setup, objects the key cannot describe.
+        """
+        bound = inspect.signature(dm_sim.make_sim).bind(*args, **kwargs)
+        bound.apply_defaults()
+        parms = dict(bound.arguments)
+        if parms['seed'] is None:
+            return None
+        for parm in UNCACHED_PARMS:
+            if parms.pop(parm) is not None:
+                return None
+        return self.make_key(parms)
+
+    def make_sim(self, *args, **kwargs):
+        """Same arguments and result as dm_sim.make_sim, served from the cache
+           when the same simulation has been run before, see sim_key
+        """
+        key = self.sim_key(args, kwargs)
+        if key is None:
+            return dm_sim.make_sim(*args, **kwargs)
+        data = self.get(key)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+        data = dm_sim.make_sim(*args, **kwargs)
+        self.put(key, data)
+        return data
+
+    def make_monte_carlo(self, sim_name, num_trials, num_periods, num_weeks,
+                         num_rounds, grid_size,
+                         num_traders, num_units,
+                         lower_bound, upper_bound,
+                         trader_objects, engine='object', fast_dispatch=False,
+                         seed=None):
+        """Same arguments and result as dm_sim.make_monte_carlo with each
+           trial served from the cache, needs a seed to cache anything
+           Markets of the trials not in the cache are solved in one call, see
+           dm_sim.make_setups
+        """
+        sim_data = {}
+        sim_data['parms'] = {'sim_name': sim_name, 'num_traders': num_traders, 'num_units': num_units,
+                             'num_weeks': num_weeks, 'num_periods': num_periods, 'num_rounds': num_rounds,
+                             'grid_size': grid_size, 'lower_bound':lower_bound, 'upper_bound': upper_bound,
+                             'trader_objects': trader_objects, 'engine': engine,
+                             'fast_dispatch': fast_dispatch, 'seed': seed}
+
+        sim_args = (sim_name, num_periods, num_weeks, num_rounds, grid_size,
+                    num_traders, num_units, lower_bound, upper_bound,
+                    trader_objects, engine, fast_dispatch)
+        trial_seeds = dm_sim.make_trial_seeds(num_trials, seed)
+        # without a root seed trial seeds are random, so they are not cached
+        keys = [self.sim_key(sim_args, {'seed': trial_seed}) if seed is not None else None
+                for trial_seed in trial_seeds]
+        trial_data = {}
+        for trial, key in enumerate(keys):
+            data = self.get(key) if key is not None else None
+            if data is not None:
+                self.hits += 1
+                trial_data[trial] = data
+
+        todo = [trial for trial in range(num_trials) if trial not in trial_data]
+        setups = dm_sim.make_setups(sim_args, [trial_seeds[trial] for trial in todo])
+        for trial, setup in zip(todo, setups):
+            data = dm_sim.make_sim(*sim_args, seed=trial_seeds[trial], setup=setup)
+            if keys[trial] is not None:
+                self.misses += 1
+                self.put(keys[trial], data)
+            trial_data[trial] = data
+
+        for trial in range(num_trials):
+            sim_data[trial] = trial_data[trial]
+        return sim_data
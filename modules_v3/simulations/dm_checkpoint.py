@@ -0,0 +1,63 @@
+import os
+import pickle
+import numpy as np                              # import numpy
+
+# make_sim parameters that must match for a checkpoint to be resumed,
+# num_weeks may change so a finished run can be extended
+CHECKED_PARMS = ('sim_name', 'num_periods', 'num_rounds', 'grid_size', 'num_traders',
+                 'num_units', 'lower_bound', 'upper_bound', 'engine', 'fast_dispatch',
+                 'prune', 'active_only')
+
+
+def seed_identity(seed):
+    """Returns entropy, spawn key and pool size of the SeedSequence make_sim
+       builds from seed, so an int and its SeedSequence compare equal
+    """
+    if seed is None:
+        return None
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return seed_seq.entropy, tuple(seed_seq.spawn_key), seed_seq.pool_size
+
+
+def traders_identity(trader_objects):
+    """Returns [(qualified class name, number)] for make_sim's trader_objects"""
+    return [(f"{trader.__module__}.{trader.__qualname__}", num)
+            for trader, num in trader_objects]
+
+
+def events_identity(events):
+    """Returns the definitions of scheduled events, see dm_events.Event.definition"""
+    return [event.definition() for event in events or []]
+
+
+# parameters compared by identity, not by value: pickled classes, seeds and
+# events that carry the state apply left in them
+IDENTITIES = {'seed': seed_identity, 'trader_objects': traders_identity,
+              'events': events_identity}
+
+
+def save_checkpoint(path, state):
+    """Pickle state to path, a crash while writing leaves the last checkpoint intact"""
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(path):
+    """Returns state saved by save_checkpoint, None if there is no checkpoint"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def check_parms(state, parms):
+    """Raise ValueError if parms differ from those the checkpoint was made with"""
+    for parm in CHECKED_PARMS:
+        if state['parms'][parm] != parms[parm]:
+            raise ValueError(f"checkpoint was made with {parm}={state['parms'][parm]!r}, "
+                             f"not {parms[parm]!r}")
+    for parm, identity in IDENTITIES.items():
+        saved, given = identity(state['parms'][parm]), identity(parms[parm])
+        if saved != given:
+            raise ValueError(f"checkpoint was made with {parm}={saved!r}, not {given!r}")
@@ -0,0 +1,114 @@
+import numpy as np
+
+# one row per contract, trader ids are indexes into ContractLog.trader_names;
+# fields 0-7 keep the positions of the contract tuple, week and period follow
+CONTRACT_DTYPE = np.dtype([('round', np.int16), ('price', np.int32),
+                           ('buyer', np.int32), ('seller', np.int32),
+                           ('b_unit', np.int16), ('b_value', np.int32),
+                           ('s_unit', np.int16), ('s_cost', np.int32),
+                           ('week', np.int32), ('period', np.int16)])
+
+# fields of a contract row from a period engine, same order as the extended contract tuple
+ROW_FIELDS = ('round', 'price', 'buyer', 'seller', 'b_unit', 'b_value', 's_unit', 's_cost')
+
+
+class ContractLog(object):
+    """Columnar contract log stored in a NumPy structured array
+
+       Rows are appended in (week, period) order and storage doubles when
+       full.  Traders are stored as integer ids; trader_names[id] gives
+       the name used in the tuple contracts made by Bargain.
+    """
+
+    def __init__(self, trader_names, capacity=1024):
+        self.trader_names = list(trader_names)  # trader name for each integer id
+        self.trader_ids = {name: k for k, name in enumerate(self.trader_names)}
+        self.data = np.zeros(capacity, dtype=CONTRACT_DTYPE)
+        self.size = 0  # number of rows in use
+
+    def __len__(self):
+        return self.size
+
+    def grow(self, needed):
+        """Double capacity until needed more rows fit"""
+        capacity = max(len(self.data), 1)
+        while self.size + needed > capacity:
+            capacity *= 2
+        if capacity > len(self.data):
+            data = np.zeros(capacity, dtype=CONTRACT_DTYPE)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def extend_rows(self, week, period, rows):
+        """Append contracts made in week, period
+           rows = integer array, one row per contract with columns ROW_FIELDS
+        """
+        rows = np.asarray(rows)
+        k = len(rows)
+        if k == 0:
+            return
+        self.grow(k)
+        block = self.data[self.size:self.size + k]
+        block['week'] = week
+        block['period'] = period
+        for column, field in enumerate(ROW_FIELDS):
+            block[field] = rows[:, column]
+        self.size += k
+
+    def trim(self):
+        """Release unused capacity"""
+        self.data = self.data[:self.size].copy()
+
+    def records(self):
+        """Returns structured array of all contracts (a view, no copy)"""
+        return self.data[:self.size]
+
+    def week(self, week):
+        """Returns contracts made in week (a view, no copy)"""
+        weeks = self.data['week'][:self.size]
+        first = np.searchsorted(weeks, week, side='left')
+        last = np.searchsorted(weeks, week, side='right')
+        return self.data[first:last]
+
+    def select(self, week=None, period=None, round=None):
+        """Returns contracts matching the given week, period and round"""
+        records = self.records() if week is None else self.week(week)
+        if period is None and round is None:
+            return records
+        keep = np.ones(len(records), dtype=bool)
+        if period is not None:
+            keep &= records['period'] == period
+        if round is not None:
+            keep &= records['round'] == round
+        return records[keep]
+
+    def prices(self, week=None):
+        return self.select(week)['price']
+
+    def to_tuples(self, week=None):
+        """Returns contracts as the extended contract tuples made by Bargain"""
+        names = self.trader_names
+        return [(r, p, names[b], names[s], bu, bv, su, sc)
+                for r, p, b, s, bu, bv, su, sc
+                in zip(*(self.select(week)[field].tolist() for field in ROW_FIELDS))]
+
+    def save_npz(self, path):
+        """Write contracts and trader names to a compressed .npz file"""
+        np.savez_compressed(path, contracts=self.records(),
+                            trader_names=np.array(self.trader_names))
+
+    @classmethod
+    def load_npz(cls, path):
+        with np.load(path) as saved:
+            contracts = saved['contracts']
+            log = cls(saved['trader_names'].tolist(), capacity=max(len(contracts), 1))
+            for field in CONTRACT_DTYPE.names:  # by name, files may use an older field order
+                log.data[field][:len(contracts)] = contracts[field]
+            log.size = len(contracts)
+        return log
+
+    def to_arrow(self):
+        """Returns contracts as a pyarrow Table, column buffers are not converted to tuples"""
+        import pyarrow as pa  # optional dependency, only needed for Arrow export
+        records = self.records()
+        return pa.table({field: records[field] for field in CONTRACT_DTYPE.names})
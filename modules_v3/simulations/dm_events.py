@@ -0,0 +1,187 @@
+from environment.dm_agents import Trader
+
+
+def same_layout(cls, base):
+    """True if instances of cls and base have the same memory layout, the
+       condition for assigning __class__ between them
+    """
+    return ((cls.__basicsize__, cls.__dictoffset__, cls.__weakrefoffset__)
+            == (base.__basicsize__, base.__dictoffset__, base.__weakrefoffset__))
+
+
+class EventState(object):
+    """What scheduled events change, shared with the period engine
+
+       agents = trader objects, index = trader id
+       closed_cells = locations traders may not move into or bargain at
+       frozen = names of traders whose moves are refused, they stay put
+    """
+
+    def __init__(self, agents):
+        self.agents = agents
+        self.closed_cells = set()
+        self.frozen = set()
+
+    def select(self, traders):
+        """Returns agents for trader ids in traders, every agent if None"""
+        if traders is None:
+            return list(self.agents)
+        return [self.agents[trader_id] for trader_id in traders]
+
+
+def boundary(when):
+    """Returns (week, period), a bare week means the start of period 0"""
+    if isinstance(when, tuple):
+        return when
+    return (when, 0)
+
+
+class Event(object):
+    """Base class for scheduled events
+
+       The event is applied at the boundary begin and undone at the boundary
+       end, both a week or (week, period), before that period runs.
+       end = None leaves the event in place.
+    """
+
+    def __init__(self, begin, end=None):
+        self.begin = boundary(begin)
+        self.end = None if end is None else boundary(end)
+        if self.end is not None and self.end <= self.begin:
+            raise ValueError(f"event ends at {self.end}, before it begins at {self.begin}")
+
+    def apply(self, state):
+        raise NotImplementedError
+
+    def undo(self, state):
+        raise NotImplementedError
+
+    def definition(self):
+        """Returns what the event does and when, without what apply changed,
+           equal for equal events after pickling
+        """
+        cls = type(self)
+        return (f"{cls.__module__}.{cls.__qualname__}", self.begin, self.end)
+
+
+class StrategySwap(Event):
+    """Traders switch to strategy, a Trader subclass, for the event window
+
+       The swap changes the class of each trader object in place; names,
+       units, location and random stream are untouched and surplus is
+       credited to the strategy in use at contract time.
+       strategy must be a Trader subclass that declares __slots__ = () (as
+       must every class between it and Trader) so it shares Trader's layout,
+       a class without __slots__ raises ValueError here, before the run.
+       traders = trader ids to swap, None = every trader
+    """
+
+    def __init__(self, begin, end, strategy, traders=None):
+        super().__init__(begin, end)
+        if not (isinstance(strategy, type) and issubclass(strategy, Trader)):
+            raise ValueError(f"{strategy!r} is not a Trader subclass")
+        if not same_layout(strategy, Trader):
+            raise ValueError(f"{strategy.__qualname__} adds instance state (a __dict__ or "
+                             f"slots), declare __slots__ = () to swap traders to it")
+        self.strategy = strategy
+        self.traders = traders
+        self.saved = []  # (agent, strategy before the swap)
+
+    def definition(self):
+        strategy = f"{self.strategy.__module__}.{self.strategy.__qualname__}"
+        return super().definition() + (strategy, self.traders)
+
+    def apply(self, state):
+        self.saved = [(agent, agent.__class__) for agent in state.select(self.traders)]
+        for agent, old in self.saved:
+            agent.__class__ = self.strategy
+
+    def undo(self, state):
+        for agent, old in self.saved:
+            agent.__class__ = old
+        self.saved = []
+
+
+class CloseCells(Event):
+    """Locations in cells are closed: moves into them are refused and no
+       bargaining takes place there, traders already inside may leave
+    """
+
+    def __init__(self, begin, end, cells):
+        super().__init__(begin, end)
+        self.cells = set(cells)
+        self.added = set()  # cells this event closed, others were closed already
+
+    def definition(self):
+        return super().definition() + (sorted(self.cells),)
+
+    def apply(self, state):
+        self.added = self.cells - state.closed_cells
+        state.closed_cells |= self.added
+
+    def undo(self, state):
+        state.closed_cells -= self.added
+        self.added = set()
+
+
+class FreezeTraders(Event):
+    """Traders are still asked to move but stay where they are
+       traders = trader ids to freeze, None = every trader
+    """
+
+    def __init__(self, begin, end=None, traders=None):
+        super().__init__(begin, end)
+        self.traders = traders
+        self.added = set()  # names this event froze
+
+    def definition(self):
+        return super().definition() + (self.traders,)
+
+    def apply(self, state):
+        names = {agent.name for agent in state.select(self.traders)}
+        self.added = names - state.frozen
+        state.frozen |= self.added
+
+    def undo(self, state):
+        state.frozen -= self.added
+        self.added = set()
+
+
+class EventSchedule(object):
+    """Events indexed by the (week, period) boundaries where they begin or end
+
+       run is called before every period, boundaries without an event cost
+       one dictionary lookup.  At a boundary events that end are undone
+       before events that begin are applied.
+    """
+
+    def __init__(self, events, agents):
+        self.events = list(events)
+        self.state = EventState(agents)
+        self.boundaries = {}  # dictionary key=(week, period), value = [ends, begins]
+        for event in self.events:
+            self.add_boundaries(event)
+
+    def add_boundaries(self, event):
+        self.boundaries.setdefault(event.begin, ([], []))[1].append(event)
+        if event.end is not None:
+            self.boundaries.setdefault(event.end, ([], []))[0].append(event)
+
+    def add(self, event):
+        """Schedule event, its begin must not have been run yet"""
+        self.events.append(event)
+        self.add_boundaries(event)
+
+    def get_state(self):
+        return self.state
+
+    def run(self, week, period):
+        """Apply and undo events at the start of week, period"""
+        changes = self.boundaries.get((week, period))
+        if changes is None:
+            return
+        ends, begins = changes
+        for event in ends:
+            event.undo(self.state)
+        for event in begins:
+            event.apply(self.state)
@@ -0,0 +1,126 @@
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import simulations.dm_sim as dm_sim
+from simulations.dm_events import EventSchedule
+
+
+def make_prefix(sim_name, num_periods, event_begin,
+                num_rounds, grid_size,
+                num_traders, num_units,
+                lower_bound, upper_bound,
+                trader_objects, engine='object', fast_dispatch=False,
+                seed=None, events=None, setup=None):
+    """Runs make_sim for weeks 0 to event_begin - 1 and returns the
+       checkpoint at the end of the last one as pickled bytes
+       events = scheduled events shared by every variant
+       setup = (agents, market) from dm_sim.make_setups, None builds them here
+    """
+    if event_begin < 1:
+        raise ValueError("the shared prefix needs at least one week, event_begin >= 1")
+    with tempfile.TemporaryDirectory() as path:
+        checkpoint_path = os.path.join(path, 'prefix.pkl')
+        dm_sim.make_sim(sim_name, num_periods, event_begin, num_rounds, grid_size,
+                        num_traders, num_units, lower_bound, upper_bound,
+                        trader_objects, engine, fast_dispatch, seed=seed, events=events,
+                        checkpoint_path=checkpoint_path, checkpoint_every=event_begin,
+                        setup=setup)
+        with open(checkpoint_path, 'rb') as f:
+            return f.read()
+
+
+def run_variant(snapshot, num_weeks, events=None):
+    """Runs make_sim from snapshot (bytes from make_prefix) to num_weeks with
+       events added to the schedule, returns make_sim's data for all weeks
+    """
+    state = pickle.loads(snapshot)  # a fresh copy, snapshot can be used again
+    parms = dict(state['parms'])
+    events = list(events or [])
+    for event in events:
+        if event.begin < (state['week'], 0):
+            raise ValueError(f"event at {event.begin} begins before the fork at week {state['week']}")
+    if events:
+        if state['schedule'] is None:
+            state['schedule'] = EventSchedule(events, state['agents'])
+        else:
+            for event in events:
+                state['schedule'].add(event)
+    parms['num_weeks'] = num_weeks
+    parms['events'] = (parms['events'] or []) + events
+    state['parms'] = dict(state['parms'], events=parms['events'])  # the schedule runs them
+    return dm_sim.make_sim(**parms, snapshot=state)
+
+
+def make_fork_sim(sim_name, num_periods, num_weeks, event_begin,
+                  num_rounds, grid_size,
+                  num_traders, num_units,
+                  lower_bound, upper_bound,
+                  trader_objects, variants, engine='object', fast_dispatch=False,
+                  seed=None, events=None, setup=None):
+    """Runs weeks before event_begin once and every variant from there
+        Returns dictionary key=variant name, value = make_sim data for all weeks
+        variants = dictionary key=variant name, value = list of dm_events.Event
+                   beginning at event_begin or later, [] continues unchanged
+        Each variant gives the results make_sim would with the same seed and
+        events + the variant's events, at the cost of one prefix plus one
+        suffix per variant.
+    """
+    snapshot = make_prefix(sim_name, num_periods, event_begin, num_rounds, grid_size,
+                           num_traders, num_units, lower_bound, upper_bound,
+                           trader_objects, engine, fast_dispatch, seed, events, setup)
+    return {name: run_variant(snapshot, num_weeks, variant_events)
+            for name, variant_events in variants.items()}
+
+
+def run_fork_trial(trial, trial_seed, setup, sim_args, variants, engine, fast_dispatch, events):
+    """Process pool worker: runs make_fork_sim for trial, returns (trial, results)"""
+    return trial, make_fork_sim(*sim_args, variants, engine, fast_dispatch, trial_seed, events,
+                                setup)
+
+
+def make_fork_monte_carlo(sim_name, num_trials, num_periods, num_weeks, event_begin,
+                          num_rounds, grid_size,
+                          num_traders, num_units,
+                          lower_bound, upper_bound,
+                          trader_objects, variants, engine='object', fast_dispatch=False,
+                          seed=None, events=None, max_workers=1):
+    """Runs make_fork_sim for num_trials and returns dictionary key=variant name,
+        value = sim_data table as make_monte_carlo, so analyze_eff_data works
+        on each variant
+        seed = root seed, trial k gets make_monte_carlo's seed for trial k
+        max_workers = 1 runs trials here, otherwise on a process pool
+                      (None = os.cpu_count() workers)
+    """
+    parms = {'sim_name': sim_name, 'num_traders': num_traders, 'num_units': num_units,
+             'num_weeks': num_weeks, 'num_periods': num_periods, 'num_rounds': num_rounds,
+             'grid_size': grid_size, 'lower_bound': lower_bound, 'upper_bound': upper_bound,
+             'trader_objects': trader_objects, 'engine': engine,
+             'fast_dispatch': fast_dispatch, 'seed': seed, 'event_begin': event_begin}
+    sim_data = {name: {'parms': dict(parms, variant=name)} for name in variants}
+    sim_args = (sim_name, num_periods, num_weeks, event_begin, num_rounds, grid_size,
+                num_traders, num_units, lower_bound, upper_bound, trader_objects)
+    trial_seeds = dm_sim.make_trial_seeds(num_trials, seed)
+    setups = dm_sim.make_setups((sim_name, num_periods, num_weeks, num_rounds, grid_size,
+                                 num_traders, num_units, lower_bound, upper_bound,
+                                 trader_objects), trial_seeds)
+
+    if max_workers == 1:
+        results = (run_fork_trial(trial, trial_seeds[trial], setups[trial], sim_args,
+                                  variants, engine, fast_dispatch, events)
+                   for trial in range(num_trials))
+        for trial, variant_data in results:
+            for name, data in variant_data.items():
+                sim_data[name][trial] = data
+        return sim_data
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_fork_trial, trial, trial_seeds[trial], setups[trial],
+                                   sim_args, variants, engine, fast_dispatch, events)
+                   for trial in range(num_trials)]
+        for future in as_completed(futures):
+            trial, variant_data = future.result()
+            for name, data in variant_data.items():
+                sim_data[name][trial] = data
+    return sim_data
@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class GridLog(object):
+    """Per-period grid snapshots stored as cell ids indexed by trader id
+
+       Row k of self.cells holds cell = x * grid_size + y for every trader
+       at the end of one period, in the smallest unsigned int type that fits
+       grid_size**2 cells.  Storage doubles when full.  get_grid rebuilds the
+       dictionary of location -> list of trader names made by get_grid of
+       the period engines, names listed in trader id order.
+    """
+
+    def __init__(self, trader_names, grid_size, capacity=64):
+        self.trader_names = list(trader_names)  # trader name for each integer id
+        self.grid_size = grid_size
+        self.dtype = np.uint16 if grid_size * grid_size <= np.iinfo(np.uint16).max else np.uint32
+        self.cells = np.zeros((capacity, len(self.trader_names)), dtype=self.dtype)
+        self.rows = {}  # dictionary key=(week, period), value = row in self.cells
+        self.size = 0   # number of rows in use
+
+    def __len__(self):
+        return self.size
+
+    def append(self, week, period, cells):
+        """Store snapshot for week, period
+           cells = integer array of cell ids indexed by trader id
+        """
+        if self.size == len(self.cells):
+            grown = np.zeros((max(2 * self.size, 1), self.cells.shape[1]), dtype=self.dtype)
+            grown[:self.size] = self.cells[:self.size]
+            self.cells = grown
+        self.cells[self.size] = cells
+        self.rows[(week, period)] = self.size
+        self.size += 1
+
+    def trim(self):
+        """Release unused capacity"""
+        self.cells = self.cells[:self.size].copy()
+
+    def get_cells(self, week, period):
+        """Returns cell ids indexed by trader id (a view, no copy)"""
+        return self.cells[self.rows[(week, period)]]
+
+    def get_locations(self, week, period):
+        """Returns x and y arrays indexed by trader id"""
+        cells = self.get_cells(week, period).astype(np.int64)
+        return cells // self.grid_size, cells % self.grid_size
+
+    def get_grid(self, week, period):
+        """Returns dictionary s_grid[loc] = list of trader names at loc"""
+        x, y = self.get_locations(week, period)
+        s_grid = {}
+        for name, loc in zip(self.trader_names, zip(x.tolist(), y.tolist())):
+            s_grid.setdefault(loc, []).append(name)
+        return s_grid
+
+    def week_grids(self, week):
+        """Returns list-like view of the grids for each period of week"""
+        return WeekGrids(self, week)
+
+
+class WeekGrids(object):
+    """Read-only sequence of one week's grids, each rebuilt on access"""
+
+    def __init__(self, grid_log, week):
+        self.grid_log = grid_log
+        self.week = week
+        self.num_periods = sum(1 for week_k, period in grid_log.rows if week_k == week)
+
+    def __len__(self):
+        return self.num_periods
+
+    def __getitem__(self, period):
+        if period < 0:
+            period += self.num_periods
+        if not 0 <= period < self.num_periods:
+            raise IndexError("period out of range")
+        return self.grid_log.get_grid(self.week, period)
+
+    def __iter__(self):
+        for period in range(self.num_periods):
+            yield self.grid_log.get_grid(self.week, period)
+
+    def __repr__(self):
+        return repr(list(self))
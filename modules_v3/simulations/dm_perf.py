@@ -0,0 +1,37 @@
+import time
+
+# wall clock used to time phases
+clock = time.perf_counter
+
+
+class PeriodPerf(object):
+    """Wall time and counts per phase of run_period, summed over every
+       period run since the object was built (a week in make_sim)
+
+       Phases: travel = Travel.run, match = listing locations with a buyer
+       and a seller, bargain = Bargain.run at those locations, bookkeeping =
+       contract and surplus records.  Counts are worked out from sizes the
+       period engine already knows, so the hot loops are not touched;
+       requests_bound is the message count if no bargaining round is skipped,
+       an upper bound on the messages actually sent.
+    """
+
+    PHASES = ('travel', 'match', 'bargain', 'bookkeeping')
+    COUNTERS = ('periods', 'moves', 'cells_bargained', 'rounds', 'rounds_skipped',
+                'requests_bound', 'contracts')
+
+    def __init__(self):
+        self.times = dict.fromkeys(self.PHASES, 0.0)  # seconds by phase
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+
+    def add_time(self, phase, seconds):
+        self.times[phase] += seconds
+
+    def count(self, counter, n=1):
+        self.counts[counter] += n
+
+    def get_results(self):
+        """Returns dictionary with 'time' (seconds by phase, and total) and 'counts'"""
+        times = dict(self.times)
+        times['total'] = sum(self.times.values())
+        return {'time': times, 'counts': dict(self.counts)}
@@ -0,0 +1,140 @@
+import numpy as np
+
+
+def metric_names(trader_objects):
+    """Returns metrics kept for a simulation: 'eff' then the surplus of each
+       strategy in trader_objects (the keys of data[week]['type_effs'])
+    """
+    strategies = []
+    for trader, num in trader_objects:
+        if trader.__name__ not in strategies:
+            strategies.append(trader.__name__)
+    return ['eff'] + strategies
+
+
+class RunningStats(object):
+    """Welford running mean and variance with min and max, element-wise
+       over arrays of a fixed shape, updated one trial at a time
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)          # sum of squared deviations from the mean
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+    def update(self, x):
+        x = np.asarray(x, dtype=float)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        np.minimum(self.min, x, out=self.min)
+        np.maximum(self.max, x, out=self.max)
+
+    def get_std(self):
+        """Sample standard deviation (ddof=1), nan with fewer than two trials"""
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    def get_sem(self):
+        """Standard error of the mean, as scipy.stats.sem"""
+        return self.get_std() / np.sqrt(max(self.count, 1))
+
+
+class ResultsCube(object):
+    """Monte Carlo results in an array shaped (trial x week x metric)
+
+       Trials fill in as they finish, rows of unfinished trials are nan.
+       RunningStats keeps mean, sem, min and max up to date as trials are
+       added, quantiles are taken from the cube itself, 8 bytes per
+       trial, week and metric instead of every trial's data dictionary.
+    """
+
+    def __init__(self, num_trials, num_weeks, metrics=('eff',)):
+        self.metrics = list(metrics)
+        self.values = np.full((num_trials, num_weeks, len(self.metrics)), np.nan)
+        self.done = np.zeros(num_trials, dtype=bool)
+        self.stats = RunningStats((num_weeks, len(self.metrics)))
+
+    def __len__(self):
+        return int(self.done.sum())
+
+    def trial_values(self, data):
+        """Returns (week x metric) array from make_sim data"""
+        num_weeks = self.values.shape[1]
+        values = np.full((num_weeks, len(self.metrics)), np.nan)
+        for week in range(num_weeks):
+            week_data = data[week]
+            for k, metric in enumerate(self.metrics):
+                if metric == 'eff':
+                    values[week, k] = week_data['eff']
+                else:
+                    values[week, k] = week_data['type_effs'].get(metric, np.nan)
+        return values
+
+    def add_trial(self, trial, data):
+        """Store make_sim data for trial, data can be dropped afterwards"""
+        self.add_values(trial, self.trial_values(data))
+
+    def add_values(self, trial, values):
+        """Store (week x metric) values for trial"""
+        if self.done[trial]:
+            raise ValueError(f"trial {trial} is already in the cube")
+        self.values[trial] = values
+        self.done[trial] = True
+        self.stats.update(values)
+
+    @classmethod
+    def from_sim_data(cls, sim_data, metrics=None):
+        """Build a cube from a make_monte_carlo table"""
+        parms = sim_data['parms']
+        if metrics is None:
+            metrics = metric_names(parms['trader_objects'])
+        trials = [trial for trial in sim_data if trial != 'parms']
+        cube = cls(max(trials) + 1 if trials else 0, parms['num_weeks'], metrics)
+        for trial in trials:
+            cube.add_trial(trial, sim_data[trial])
+        return cube
+
+    def trim(self):
+        """Release rows after the last finished trial"""
+        size = int(np.flatnonzero(self.done)[-1]) + 1 if self.done.any() else 0
+        self.values = self.values[:size].copy()
+        self.done = self.done[:size].copy()
+
+    def get_max_sem(self, metric='eff'):
+        """Returns the largest standard error over weeks of metric,
+           inf with fewer than two trials
+        """
+        if self.stats.count < 2:
+            return np.inf
+        return float(self.stats.get_sem()[:, self.metrics.index(metric)].max())
+
+    def get_metric(self, metric='eff'):
+        """Returns (trial x week) values of metric for finished trials"""
+        return self.values[self.done, :, self.metrics.index(metric)]
+
+    def get_summary(self, metric='eff', quantiles=()):
+        """Returns dictionary of per week arrays: mean, sem, min, max and
+           q<quantile> for each quantile in quantiles
+        """
+        k = self.metrics.index(metric)
+        stats = self.stats
+        summary = {'mean': stats.mean[:, k].copy(), 'sem': stats.get_sem()[:, k],
+                   'min': stats.min[:, k].copy(), 'max': stats.max[:, k].copy()}
+        if quantiles:
+            qs = np.quantile(self.get_metric(metric), quantiles, axis=0)
+            for quantile, q in zip(quantiles, qs):
+                summary[f"q{quantile}"] = q
+        return summary
+
+    def analyze_eff_data(self, metric='eff'):
+        """Same results as dm_sim.analyze_eff_data in one vectorized call:
+           eff_avg, std_errors, eff_min, eff_max lists by week
+        """
+        summary = self.get_summary(metric)
+        return (summary['mean'].tolist(), summary['sem'].tolist(),
+                summary['min'].tolist(), summary['max'].tolist())
@@ -1,138 +1,475 @@
 # import random as rnd
 # import operator
-# import os
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import matplotlib.pyplot as plt                 # import matplotlib
-# import numpy as np                              # import numpy
+import numpy as np                              # import numpy
 # import time
 # import copy
 # import json
 from scipy.stats import sem
 
-# This works only if notebook is in same folder
 # import dm_bargain
 # import dm_travel
-import dm_agents
-#import dm_env as env
+import environment.dm_agents as dm_agents
+import environment.dm_env as env
 # import dm_utils as dm
-import dm_sim_period as simp
+import simulations.dm_sim_period as simp
+import simulations.dm_array_period as arrp
+from simulations.dm_contract_log import ContractLog
+from simulations.dm_grid_log import GridLog
+from simulations.dm_results_cube import ResultsCube, metric_names
+from simulations.dm_events import EventSchedule
+from simulations.dm_checkpoint import save_checkpoint, load_checkpoint, check_parms
 import dm_process_results as pr
-import env_make_agents as mkt
+import environment.env_make_agents as mkt
+
+class SimData(dict):
+    """make_sim results, data[week] for every week
+
+       The whole run's contract_log and grid_log are attributes, not keys,
+       so iterating over data gives only weeks.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.contract_log = None  # dm_contract_log.ContractLog
+        self.grid_log = None      # dm_grid_log.GridLog
+
+# period engines selectable in make_sim
+ENGINES = {'object': simp.SimPeriod,     # one Trader object per agent, message passing
+           'array': arrp.ArraySimPeriod}  # NumPy struct-of-arrays, ZID family only
 
 def make_sim(sim_name, num_periods, num_weeks,
              num_rounds, grid_size,
              num_traders, num_units,
              lower_bound, upper_bound,
-             trader_objects):
+             trader_objects, engine='object', fast_dispatch=False,
+             seed=None, offer_history=None, bargain_workers=None, perf=True,
+             prune=False, active_only=False, events=None, checkpoint_path=None,
+             checkpoint_every=1, snapshot=None, setup=None):
     """Runs one complete simulation and returns data in
         effs[treatment][trial]
+        engine = 'object' or 'array', see ENGINES
+        fast_dispatch = if True object engine institutions call agents directly
+        seed = int or SeedSequence, a given seed gives bit-identical results
+        offer_history = dm_offer_history.OfferHistory to record offers in (object
+                        engine only), default None does not record offers
+        bargain_workers = if not None locations bargain in parallel on this many
+                          workers (object engine only), see SimPeriod.run_parallel_bargaining
+        perf = if True data[week]['perf'] holds phase times and counts for the
+               week, see dm_perf.PeriodPerf, False turns instrumentation off
+        prune = if True bargaining stops once no contract is possible at a location
+                (object engine only), skipping draws so results change for a seed
+        active_only = if True traders with no units left are not asked to move or
+                      bargain until next week (object engine only), results change for a seed
+        events = list of dm_events.Event (strategy swaps, closed cells, frozen
+                 traders) applied in place before the periods where they begin
+                 and undone where they end (object engine only)
+        checkpoint_path = if not None agents, random streams and results so far are
+                          saved to this file at the end of every week, and if it
+                          already holds a checkpoint the run resumes after its week,
+                          see resume_sim
+        checkpoint_every = weeks between checkpoints, the last week is always saved
+        snapshot = checkpoint state to start from instead of week 0 (it is changed
+                   as the run goes on, pass a fresh copy), see dm_fork
+        setup = (agents, market) from make_setups for this seed, None builds them here
+        Returns SimData, data[week] for every week.
+        data[week]['contracts'] is a structured array view into data.contract_log,
+        see dm_contract_log.ContractLog; contract[0] to contract[7] are the old
+        tuple fields but buyer and seller (contract[2], contract[3]) are integer
+        ids, data.contract_log.trader_names[id] is the name
+        data[week]['grids'][period] is rebuilt on access from data.grid_log,
+        see dm_grid_log.GridLog
     """ 
+    period_engine = ENGINES[engine]
 
-    # data table for simulation
-    data = {}
+    # independent random streams split from one SeedSequence:
+    # agent setup (and one child per trader), then travel and bargaining
+    maker_seq, period_seq = split_seed(seed)
+    engine_options = {'rng': np.random.default_rng(period_seq), 'perf': perf}
+    if engine == 'object':
+        engine_options['fast_dispatch'] = fast_dispatch
+        engine_options['offer_history'] = offer_history
+        engine_options['prune'] = prune
+        engine_options['active_only'] = active_only
+    elif offer_history is not None:
+        raise ValueError(f"engine '{engine}' does not record offers")
+    elif bargain_workers is not None:
+        raise ValueError(f"engine '{engine}' does not bargain in parallel")
+    elif prune:
+        raise ValueError(f"engine '{engine}' does not prune bargaining rounds")
+    elif active_only:
+        raise ValueError(f"engine '{engine}' moves every trader as one array, active_only does not apply")
+    elif events:
+        raise ValueError(f"engine '{engine}' does not run scheduled events")
+    if checkpoint_path is not None and offer_history is not None:
+        raise ValueError("offers are not recorded when a run is checkpointed")
+    parms = {'sim_name': sim_name, 'num_periods': num_periods, 'num_weeks': num_weeks,
+             'num_rounds': num_rounds, 'grid_size': grid_size, 'num_traders': num_traders,
+             'num_units': num_units, 'lower_bound': lower_bound, 'upper_bound': upper_bound,
+             'trader_objects': trader_objects, 'engine': engine, 'fast_dispatch': fast_dispatch,
+             'seed': seed, 'perf': perf, 'prune': prune, 'active_only': active_only,
+             'events': events}
 
-    # make agents
-    agent_maker = mkt.MakeAgents(num_traders, trader_objects, num_units, 
-                                grid_size, lower_bound, upper_bound)
-    agent_maker.make_agents()
-    agent_maker.set_locations(grid_size)
-    agents = agent_maker.get_agents()
-  
-    # set up market
-    agent_maker.make_market(sim_name)
-    market = agent_maker.get_market()
+    checkpoint = snapshot
+    if checkpoint is None and checkpoint_path is not None:
+        checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is not None:
+        # pick up after the last finished week
+        check_parms(checkpoint, parms)
+        first_week = checkpoint['week']
+        data = checkpoint['data']
+        agents = checkpoint['agents']
+        market = checkpoint['market']
+        schedule = checkpoint['schedule']
+        contract_log = checkpoint['contract_log']
+        grid_log = checkpoint['grid_log']
+        engine_options['rng'] = checkpoint['rng']
+        if schedule is not None:
+            engine_options['restrictions'] = schedule.get_state()
+    else:
+        first_week = 0
 
-    # run sim
-    for week in range(num_weeks):
-        data[week] = {}
-        for agent in agents:
-            agent.start(None)
-        contracts = []
-        sim_grids = []
-        sim1 = simp.SimPeriod(sim_name, num_rounds, agents, 
-               market, grid_size)
-        for period in range(num_periods):
-            sim1.run_period()
-            grid = sim1.get_grid()
-            sim_grids.append(grid)
-            contracts.extend(sim1.get_contracts())
+        # data table for simulation
+        data = SimData()
+
+        # make agents and market
+        if setup is None:
+            setup = make_setup(sim_name, grid_size, num_traders, num_units,
+                               lower_bound, upper_bound, trader_objects, seed)
+        agents, market = setup
+
+        # scheduled events change agents and the engine's restrictions in place
+        schedule = None
+        if events:
+            schedule = EventSchedule(events, agents)
+            engine_options['restrictions'] = schedule.get_state()
+
+        # contracts and grid snapshots for every week, trader ids index agents
+        contract_log = ContractLog([agent.name for agent in agents])
+        grid_log = GridLog([agent.name for agent in agents], grid_size)
+
+    # one worker pool for every week, shut down however the run ends
+    bargain_executor = None
+    if bargain_workers is not None:
+        bargain_executor = simp.make_bargain_executor(bargain_workers)
+        engine_options['bargain_executor'] = bargain_executor
+
+    try:
+        # run sim
+        for week in range(first_week, num_weeks):
+            data[week] = {}
+            for agent in agents:
+                agent.start(None)
+            # events at the start of the week apply before the engine is built,
+            # so its surplus records see the strategies in use this week
+            if schedule is not None:
+                schedule.run(week, 0)
+            sim1 = period_engine(sim_name, num_rounds, agents, 
+                   market, grid_size, **engine_options)
+            for period in range(num_periods):
+                if schedule is not None and period > 0:
+                    schedule.run(week, period)
+                sim1.run_period()
+                grid_log.append(week, period, sim1.get_cells())
+                contract_log.extend_rows(week, period, sim1.get_contract_rows())
         
-        data[week]['contracts'] = contracts
-        data[week]['grids'] = sim_grids
+            data[week]['grids'] = grid_log.week_grids(week)
         
-        # process results
-        pr1 = pr.ProcessResults(market, sim_name, agents, contracts)
-        pr1.calc_efficiency()
-        pr1.get_results()
-        eff = pr1.get_efficiency()
-        type_eff = pr1.get_type_surplus()
-        data[week]['eff'] = eff # single item put in list to faciliatate looping through data 
-        data[week]['type_effs'] = type_eff
+            # process results from surplus kept at contract time
+            pr1 = pr.ProcessResults(market, sim_name, agents, contract_log.week(week))
+            pr1.set_surplus(*sim1.get_surplus())
+            eff = pr1.get_efficiency()
+            type_eff = pr1.get_type_surplus()
+            data[week]['eff'] = eff # single item put in list to faciliatate looping through data 
+            data[week]['type_effs'] = type_eff
+            if perf:
+                data[week]['perf'] = sim1.get_perf()
+
+            # everything the next week starts from, one file replaced each week
+            if checkpoint_path is not None and ((week + 1) % checkpoint_every == 0
+                                                or week + 1 == num_weeks):
+                save_checkpoint(checkpoint_path,
+                                {'parms': parms, 'week': week + 1, 'data': data, 'agents': agents,
+                                 'market': market, 'schedule': schedule, 'rng': engine_options['rng'],
+                                 'contract_log': contract_log, 'grid_log': grid_log})
+    finally:
+        if bargain_executor is not None:
+            bargain_executor.shutdown()
+
+    # weekly contracts are views into one trimmed log, not copies
+    contract_log.trim()
+    data.contract_log = contract_log
+    grid_log.trim()
+    data.grid_log = grid_log
+    for week in range(num_weeks):
+        data[week]['contracts'] = contract_log.week(week)
+    if offer_history is not None:
+        offer_history.flush()
     return data
 
 
+def split_seed(seed):
+    """Returns the (agent setup, travel and bargaining) SeedSequences of seed
+
+       The same children seed.spawn(2) gives a SeedSequence not spawned from
+       before, made without changing seed, so make_setup and make_sim can
+       both split one trial seed.
+    """
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return [np.random.SeedSequence(seed_seq.entropy, spawn_key=seed_seq.spawn_key + (k,),
+                                   pool_size=seed_seq.pool_size)
+            for k in range(2)]
+
+
+def make_setup(sim_name, grid_size, num_traders, num_units,
+               lower_bound, upper_bound, trader_objects, seed, calc_equilibrium=True):
+    """Returns (agents, market) make_sim starts from for seed
+       calc_equilibrium = False leaves the market equilibrium unset, see make_setups
+    """
+    agent_maker = mkt.MakeAgents(num_traders, trader_objects, num_units, 
+                                grid_size, lower_bound, upper_bound,
+                                rng=np.random.default_rng(split_seed(seed)[0]))
+    agent_maker.make_agents()
+    agent_maker.set_locations(grid_size)
+    agent_maker.make_market(sim_name, calc_equilibrium)
+    return agent_maker.get_agents(), agent_maker.get_market()
+
+
+def make_setups(sim_args, trial_seeds):
+    """Returns make_setup for each of trial_seeds, with every market's
+       equilibrium found in one dm_env.calc_market_equilibria call
+       sim_args = make_sim positional parameters, sim_name to trader_objects
+    """
+    (sim_name, num_periods, num_weeks, num_rounds, grid_size,
+     num_traders, num_units, lower_bound, upper_bound, trader_objects) = sim_args[:10]
+    setups = [make_setup(sim_name, grid_size, num_traders, num_units, lower_bound,
+                         upper_bound, trader_objects, trial_seed, calc_equilibrium=False)
+              for trial_seed in trial_seeds]
+    if setups:
+        env.calc_market_equilibria([market for agents, market in setups])
+    return setups
+
+
+def resume_sim(checkpoint_path, num_weeks=None, bargain_workers=None):
+    """Runs make_sim with the parameters saved in checkpoint_path, picking up
+        after the last week checkpointed, and returns the same data
+        num_weeks = if not None run to this many weeks instead
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        raise FileNotFoundError(f"no checkpoint in {checkpoint_path}")
+    parms = dict(checkpoint['parms'])
+    if num_weeks is not None:
+        parms['num_weeks'] = num_weeks
+    return make_sim(**parms, bargain_workers=bargain_workers, checkpoint_path=checkpoint_path)
+
+
 def make_monte_carlo(sim_name, num_trials, num_periods, num_weeks,
                     num_rounds, grid_size,
                     num_traders, num_units,
                     lower_bound, upper_bound,
-                    trader_objects):
+                    trader_objects, engine='object', fast_dispatch=False,
+                    seed=None):
     """Runs one complete simulation and returns data in
         effs[treatment][trial]
+        seed = if not None each trial gets its own seed derived from it
     """ 
 
     sim_data = {}
     sim_data['parms'] = {'sim_name': sim_name, 'num_traders': num_traders, 'num_units': num_units,
                          'num_weeks': num_weeks, 'num_periods': num_periods, 'num_rounds': num_rounds,
                          'grid_size': grid_size, 'lower_bound':lower_bound, 'upper_bound': upper_bound,
-                         'trader_objects': trader_objects}
+                         'trader_objects': trader_objects, 'engine': engine,
+                         'fast_dispatch': fast_dispatch, 'seed': seed}
 
+    sim_args = (sim_name, num_periods, num_weeks, num_rounds, grid_size,
+                num_traders, num_units, lower_bound, upper_bound,
+                trader_objects, engine, fast_dispatch)
+    trial_seeds = make_trial_seeds(num_trials, seed)
+    setups = make_setups(sim_args, trial_seeds)
     for trial in range(num_trials):
-        sim_data[trial]  = make_sim(sim_name, num_periods, num_weeks,
-                                    num_rounds, grid_size,
-                                    num_traders, num_units,
-                                    lower_bound, upper_bound,
-                                    trader_objects)
+        sim_data[trial]  = make_sim(*sim_args, seed=trial_seeds[trial], setup=setups[trial])
+        setups[trial] = None
     return sim_data
 
-# Analyze Efficiency Data
-def analyze_eff_data(num_trials, num_weeks, data_table):
-    
-    # Set up arrays to parse data into weeks
-    week_effs = []
-    eff_avg = []
 
-    for week in range(num_weeks):
-        eff_avg.append(0)
-        week_effs.append([])
-    
-    # parse efficiencies
-    data = []
+def make_trial_seeds(num_trials, seed):
+    """Returns one independent SeedSequence per trial split from seed"""
+    return np.random.SeedSequence(seed).spawn(num_trials)
+
+
+def run_trials(trials, trial_seeds, setups, sim_args):
+    """Process pool worker: runs make_sim for each trial in trials
+       returns list of (trial, data)"""
+    results = []
+    for trial, trial_seed, setup in zip(trials, trial_seeds, setups):
+        data = make_sim(*sim_args, seed=trial_seed, setup=setup)
+        results.append((trial, data))
+    return results
+
+
+def make_parallel_monte_carlo(sim_name, num_trials, num_periods, num_weeks,
+                    num_rounds, grid_size,
+                    num_traders, num_units,
+                    lower_bound, upper_bound,
+                    trader_objects, engine='object', fast_dispatch=False,
+                    seed=None, max_workers=None, chunksize=1):
+    """Runs make_monte_carlo trials on a process pool and returns the same
+        sim_data[trial][week] table in trial order
+        seed = root seed, each trial gets its own seed derived from it so
+               results match make_monte_carlo with the same seed
+        max_workers = number of worker processes, default os.cpu_count()
+        chunksize = number of trials sent to a worker at a time
+    """ 
+
+    sim_data = {}
+    sim_data['parms'] = {'sim_name': sim_name, 'num_traders': num_traders, 'num_units': num_units,
+                         'num_weeks': num_weeks, 'num_periods': num_periods, 'num_rounds': num_rounds,
+                         'grid_size': grid_size, 'lower_bound':lower_bound, 'upper_bound': upper_bound,
+                         'trader_objects': trader_objects, 'engine': engine,
+                         'fast_dispatch': fast_dispatch, 'seed': seed}
+
+    sim_args = (sim_name, num_periods, num_weeks, num_rounds, grid_size,
+                num_traders, num_units, lower_bound, upper_bound,
+                trader_objects, engine, fast_dispatch)
+    trial_seeds = make_trial_seeds(num_trials, seed)
+    setups = make_setups(sim_args, trial_seeds)
+    trial_data = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for first in range(0, num_trials, chunksize):
+            trials = range(first, min(first + chunksize, num_trials))
+            futures.append(executor.submit(run_trials, list(trials),
+                                           trial_seeds[first:first + chunksize],
+                                           setups[first:first + chunksize], sim_args))
+        for future in as_completed(futures):
+            for trial, data in future.result():
+                trial_data[trial] = data
+
+    # keep trial order in the table
     for trial in range(num_trials):
-        effs = []
-        trial_data = data_table[trial]
-        for week in range(num_weeks):
-            week_data = trial_data[week]
-            effs.append(week_data['eff'])
-        data.append(effs)   
-
-    # process efficiencies
-    for trial_effs in data:
-      
-        for k, eff in enumerate(trial_effs):
-            eff_avg[k] += eff
-            week_effs[k].append(eff)
-            
-    #calculate avg, min, max, and sem for each week
-    std_errors = [] 
-    eff_min = []
-    eff_max = []  
-    for k in range(num_weeks):
-        eff_avg[k] /= num_trials
-        std_error = sem(week_effs[k])
-        std_errors.append(std_error)
-        eff_min.append(min(week_effs[k]))
-        eff_max.append(max(week_effs[k]))
-
-    return eff_avg, std_errors, eff_min, eff_max
+        sim_data[trial] = trial_data[trial]
+    return sim_data
+
+def run_trial_values(trial, trial_seed, setup, sim_args, metrics, sim_options=None):
+    """Process pool worker: runs make_sim for trial and returns
+       (trial, week x metric values), see ResultsCube"""
+    data = make_sim(*sim_args, seed=trial_seed, setup=setup, **(sim_options or {}))
+    cube = ResultsCube(1, sim_args[2], metrics)
+    return trial, cube.trial_values(data)
+
+
+def make_monte_carlo_cube(sim_name, num_trials, num_periods, num_weeks,
+                    num_rounds, grid_size,
+                    num_traders, num_units,
+                    lower_bound, upper_bound,
+                    trader_objects, engine='object', fast_dispatch=False,
+                    seed=None, max_workers=1, metrics=None):
+    """Runs make_monte_carlo trials and returns a ResultsCube filled in as
+        trials finish, each trial's data is dropped once its efficiencies
+        are stored
+        max_workers = 1 runs trials here, otherwise on a process pool
+                      (None = os.cpu_count() workers)
+        metrics = default 'eff' and the surplus of each strategy
+    """
+    if metrics is None:
+        metrics = metric_names(trader_objects)
+    cube = ResultsCube(num_trials, num_weeks, metrics)
+    sim_args = (sim_name, num_periods, num_weeks, num_rounds, grid_size,
+                num_traders, num_units, lower_bound, upper_bound,
+                trader_objects, engine, fast_dispatch)
+    trial_seeds = make_trial_seeds(num_trials, seed)
+    setups = make_setups(sim_args, trial_seeds)
+
+    if max_workers == 1:
+        for trial in range(num_trials):
+            cube.add_trial(trial, make_sim(*sim_args, seed=trial_seeds[trial], setup=setups[trial]))
+            setups[trial] = None
+        return cube
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_trial_values, trial, trial_seeds[trial], setups[trial],
+                                   sim_args, metrics)
+                   for trial in range(num_trials)]
+        for future in as_completed(futures):
+            cube.add_values(*future.result())
+    return cube
+
+
+def make_sequential_monte_carlo(sim_name, max_trials, num_periods, num_weeks,
+                    num_rounds, grid_size,
+                    num_traders, num_units,
+                    lower_bound, upper_bound,
+                    trader_objects, engine='object', fast_dispatch=False,
+                    seed=None, tolerance=1.0, min_trials=10, batch_size=None,
+                    max_workers=1, metrics=None, sim_options=None):
+    """Runs make_monte_carlo trials in batches until the standard error of
+        efficiency is at most tolerance in every week, or max_trials have run
+        Returns a trimmed ResultsCube, len(cube) = number of trials used and
+        cube.get_max_sem() <= tolerance when it converged
+        min_trials = trials in the first batch, at least 2
+        batch_size = trials added per batch after the first, default one per worker
+        max_workers = 1 runs trials here, otherwise on a process pool
+                      (None = os.cpu_count() workers)
+        sim_options = dictionary of other make_sim keyword arguments, such as prune
+        Trial k gets the seed make_monte_carlo gives trial k, so the trials
+        used are the first len(cube) trials of make_monte_carlo with this seed.
+    """
+    sim_options = sim_options or {}
+    if metrics is None:
+        metrics = metric_names(trader_objects)
+    min_trials = min(max(min_trials, 2), max_trials)
+    if batch_size is None:
+        batch_size = max_workers or os.cpu_count() or 1
+    cube = ResultsCube(max_trials, num_weeks, metrics)
+    sim_args = (sim_name, num_periods, num_weeks, num_rounds, grid_size,
+                num_traders, num_units, lower_bound, upper_bound,
+                trader_objects, engine, fast_dispatch)
+    # children of a SeedSequence depend only on their index, so these are
+    # the seeds of make_trial_seeds(num_trials, seed) for any num_trials
+    trial_seeds = make_trial_seeds(max_trials, seed)
+
+    executor = None if max_workers == 1 else ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        num_run = 0
+        batch = min_trials
+        while num_run < max_trials:
+            trials = range(num_run, min(num_run + batch, max_trials))
+            setups = make_setups(sim_args, trial_seeds[trials.start:trials.stop])
+            if executor is None:
+                for trial, setup in zip(trials, setups):
+                    cube.add_trial(trial, make_sim(*sim_args, seed=trial_seeds[trial], setup=setup,
+                                                   **sim_options))
+            else:
+                futures = [executor.submit(run_trial_values, trial, trial_seeds[trial], setup,
+                                           sim_args, metrics, sim_options)
+                           for trial, setup in zip(trials, setups)]
+                for future in as_completed(futures):
+                    cube.add_values(*future.result())
+            num_run = trials.stop
+            # stop only after whole batches, so the result does not depend on
+            # which worker finishes first
+            if cube.get_max_sem('eff') <= tolerance:
+                break
+            batch = batch_size
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    cube.trim()
+    return cube
+
+# Analyze Efficiency Data
+def analyze_eff_data(num_trials, num_weeks, data_table):
+    """Returns eff_avg, std_errors, eff_min, eff_max lists by week
+       over trials in data_table, see make_monte_carlo
+    """
+    effs = np.array([[data_table[trial][week]['eff'] for week in range(num_weeks)]
+                     for trial in range(num_trials)], dtype=float).reshape(num_trials, num_weeks)
+    eff_avg = effs.mean(axis=0)
+    std_errors = sem(effs, axis=0)
+    return eff_avg.tolist(), std_errors.tolist(), effs.min(axis=0).tolist(), effs.max(axis=0).tolist()
 
 if __name__ == "__main__":
     # test monte-carlo runner
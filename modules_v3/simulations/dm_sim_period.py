@@ -1,12 +1,15 @@
-import random as rnd
+#import random as rnd
 #import operator
 #import os
 #import matplotlib.pyplot as plt                 # import matplotlib
-#import numpy as np                              # import numpy
+import numpy as np                              # import numpy
 #import time
 #import copy
 #import json
 #import pprint
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import institutions.dm_bargain as dm_bargain
 #from dm_simulator import SimulateMarket
 import institutions.dm_travel as dm_travel
@@ -14,11 +17,42 @@ import environment.dm_agents as dm_agents
 #import environment.dm_env as env
 #import dm_utils as dm
 import environment.env_make_agents as mkt
+from simulations.dm_perf import PeriodPerf, clock
+
+# trader attributes a Bargain session changes, copied back from process pool workers
+BARGAIN_STATE = ('units_transacted', 'cur_unit', 'contract_this_period', 'rng')
+
+
+def make_bargain_executor(max_workers=None):
+    """Returns an executor for per-location bargaining: threads when Python
+       runs without the GIL (free-threaded build), otherwise processes
+    """
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    if gil_enabled:
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def run_bargain_sessions(sessions, num_rounds, fast_dispatch, prune=False):
+    """Pool worker: runs a Bargain session for each (agents, rng) in sessions
+       returns list of (agents, contracts, surplus, skipped_rounds) in session order
+    """
+    results = []
+    for agents, rng in sessions:
+        bargain = dm_bargain.Bargain(num_rounds, fast_dispatch, rng, prune=prune)
+        bargain.set_agents(agents)
+        bargain.run()
+        results.append((agents, bargain.get_contracts(), bargain.get_surplus(),
+                        bargain.get_skipped_rounds()))
+    return results
+
 
 class SimPeriod(object):
     """Simulate a market on grid of consisting of weeks and days using two types of trading agents"""
 
-    def __init__(self, sim_name, num_rounds, agents, market, grid_size, debug=False, plot_on=False):
+    def __init__(self, sim_name, num_rounds, agents, market, grid_size, debug=False, plot_on=False,
+                 fast_dispatch=False, rng=None, offer_history=None, bargain_executor=None,
+                 perf=False, prune=False, active_only=False, restrictions=None):
 
         self.sim_name = sim_name            # simulation name
         #self.week = week                    # current week
@@ -28,18 +62,38 @@ class SimPeriod(object):
         self.grid_size = grid_size          # simulation grid size: square
         self.debug = debug                  # if True print additional information
         self.plot_on = plot_on              # if True plot every week, otherwsie plot last week
+        self.fast_dispatch = fast_dispatch  # if True institutions call agents directly,
+                                            # otherwise they pass Messages (debug, tracing)
+        self.rng = rng if rng is not None else np.random.default_rng()  # for Travel and Bargain
+        self.offer_history = offer_history  # OfferHistory for Bargain, None = offers not recorded
+        self.bargain_executor = bargain_executor  # if not None locations bargain in parallel
+                                                  #   on this executor, see make_bargain_executor
+        if bargain_executor is not None and offer_history is not None:
+            raise ValueError("offers are not recorded when locations bargain in parallel")
+        self.perf = PeriodPerf() if perf else None  # phase timing and counts, None = off
+        self.prune = prune                  # if True Bargain skips rounds where no contract is possible
+        self.skipped_rounds = 0             # rounds skipped in the last period
+        self.active_only = active_only      # if True traders with no units left are dropped
+                                            #   from travel and bargaining for the week
+        self.restrictions = restrictions    # closed cells and frozen traders set by scheduled
+                                            #   events, see dm_events.EventState
         self.period_results = {}            # period simulation results
                                             #(moving history, market conditions), key = week
         self.market = market     # market environment object
-        self.trevel = None       # current travel institution
+        self.travel = None       # travel institution, its occupancy index persists across periods
+        self.bargain = None      # bargain institution
         self.prices = []         # list_of_prices
         self.contracts = []      # list of contracts
+        self.agent_ids = {agent.name: k for k, agent in enumerate(agents)}  # integer trader ids
 
-        self.buyer_surplus = None   # Surplus generate by buyers. Sum of (value-price)
-        self.seller_surplus = None  # Surplus generated by sellers.  Sum of (price-cost)
-        self.actual_surplus = None  # Sum of buyer surplus and seller surplus
+        # running totals over every period run since this object was built
+        self.buyer_surplus = 0      # Surplus generate by buyers. Sum of (value-price)
+        self.seller_surplus = 0     # Surplus generated by sellers.  Sum of (price-cost)
+        self.actual_surplus = 0     # Sum of buyer surplus and seller surplus
         self.efficiency = None      # (actual_surplus/eq_max_surplus) * 100.
         self.type_surplus = {}      # surplus accrued by trader type
+        for agent in agents:
+            self.type_surplus[agent.strategy] = 0
         self.results_period = {}    # complete results record
 
     def match_found(self, agents):
@@ -62,32 +116,63 @@ class SimPeriod(object):
                     agents make travel decisions
                     make contracts with agents at the same node"""
         
-        # Setup for simulation
-        t_inst = dm_travel.Travel(self.grid_size, self.agent_list, self.debug)
-        self.travel = t_inst
-        t_inst.start_travel()
-        b_inst = dm_bargain.Bargain(self.num_rounds)
+        # Setup for simulation, institutions are built on the first period
+        if self.travel is None:
+            self.travel = dm_travel.Travel(self.grid_size, self.agent_list, self.debug,
+                                           self.fast_dispatch, self.rng, self.active_only,
+                                           self.restrictions)
+            self.travel.start_travel()
+            self.bargain = dm_bargain.Bargain(self.num_rounds, self.fast_dispatch, self.rng,
+                                              self.offer_history, self.prune)
+        t_inst = self.travel
+        b_inst = self.bargain
+        b_inst.reset_surplus()
+        b_inst.reset_skipped_rounds()
         self.contracts = []
         self.prices = []
         
+        perf = self.perf
+        if perf is not None:
+            start = clock()
+        
         # Simulate Period
 
         # run travel institution to let agents travel
+        num_moves = t_inst.get_num_active()
         t_inst.run()
-        g = t_inst.get_grid()
-
-        # Walk occupied points in grid and run bargain institution at each point
-        period_contracts = []
-        for loc in g:
-            agents_at = g[loc]
-            # Run bargain if you have a BUYER and A Seller
-            if self.match_found(agents_at):
+        g = t_inst.get_active_grid()  # the whole grid unless active_only
+        if perf is not None:
+            travel_done = clock()
+            perf.add_time('travel', travel_done - start)
+
+        # Run bargain institution at each point with a BUYER and a SELLER
+        locations = list(t_inst.get_matched_locations())
+        if self.restrictions is not None and self.restrictions.closed_cells:
+            closed = self.restrictions.closed_cells
+            locations = [loc for loc in locations if loc not in closed]
+        if perf is not None:
+            match_done = clock()
+            perf.add_time('match', match_done - travel_done)
+
+        if self.bargain_executor is not None:
+            self.contracts = self.run_parallel_bargaining(g, locations)
+        else:
+            period_contracts = []
+            for loc in locations:
+                agents_at = g[loc]
                 b_inst.set_agents(agents_at)
                 b_inst.set_debug(self.debug)
                 b_inst.run()
                 loc_contracts = b_inst.get_contracts()
                 period_contracts.extend(loc_contracts)
-        self.contracts = period_contracts
+            self.contracts = period_contracts
+            self.skipped_rounds = b_inst.get_skipped_rounds()
+        if perf is not None:
+            bargain_done = clock()
+            perf.add_time('bargain', bargain_done - match_done)
+
+        if self.bargain_executor is None:
+            self.add_surplus(*b_inst.get_surplus())
         # save results
         self.period_results = {}
         history_of_travel = t_inst.get_history()
@@ -98,9 +183,110 @@ class SimPeriod(object):
         # Extract price from each contract
         for contract in self.contracts:
             self.prices.append(contract[1])
+
+        if perf is not None:
+            perf.add_time('bookkeeping', clock() - bargain_done)
+            self.count_period(g, locations, num_moves)
+        if self.active_only:
+            self.drop_exhausted(g, locations)
+
+    def drop_exhausted(self, grid, locations):
+        """Deactivate traders with no units left, only traders who bargained
+           this period can have run out
+        """
+        for loc in locations:
+            for agent in list(grid.get(loc, ())):
+                if agent.cur_unit >= agent.max_units:
+                    self.travel.deactivate(agent)
+
+    def count_period(self, grid, locations, num_moves):
+        """Adds this period's counts to self.perf, each trader makes one travel
+           request, and at a bargaining location an offer and a transact request
+           each round, contracts send one message to each party; skipped
+           rounds are not taken off, so requests_bound is an upper bound
+        """
+        perf = self.perf
+        traders_bargaining = sum(len(grid.get(loc, ())) for loc in locations)
+        num_contracts = len(self.contracts)
+        perf.count('periods')
+        perf.count('moves', num_moves)
+        perf.count('cells_bargained', len(locations))
+        perf.count('rounds', len(locations) * self.num_rounds - self.skipped_rounds)
+        perf.count('rounds_skipped', self.skipped_rounds)
+        perf.count('requests_bound', num_moves + 2 * traders_bargaining * self.num_rounds
+                   + 2 * num_contracts)
+        perf.count('contracts', num_contracts)
+
+    def get_skipped_rounds(self):
+        """Returns bargaining rounds skipped in the last period, see Bargain.trade_possible"""
+        return self.skipped_rounds
+
+    def get_perf(self):
+        """Returns phase times and counts since this object was built, None when off"""
+        if self.perf is None:
+            return None
+        return self.perf.get_results()
     
+    def run_parallel_bargaining(self, grid, locations):
+        """Runs a Bargain session for each location on self.bargain_executor
+           returns contracts merged in location order
+
+           Each location gets its own random stream spawned from self.rng in
+           location order, so results do not depend on the executor, the
+           number of workers or the order sessions finish in.
+        """
+        locations = list(locations)
+        cell_rngs = self.rng.spawn(len(locations))
+        sessions = [(list(grid[loc]), cell_rng) for loc, cell_rng in zip(locations, cell_rngs)]
+
+        # send several sessions to a worker at a time
+        chunksize = max(1, -(-len(sessions) // (4 * (os.cpu_count() or 1))))
+        chunks = [sessions[k:k + chunksize] for k in range(0, len(sessions), chunksize)]
+        num_chunks = len(chunks)
+        results = self.bargain_executor.map(run_bargain_sessions, chunks,
+                                            [self.num_rounds] * num_chunks,
+                                            [self.fast_dispatch] * num_chunks,
+                                            [self.prune] * num_chunks)
+
+        contracts = []
+        self.skipped_rounds = 0
+        for (agents, cell_rng), (session_agents, session_contracts, surplus, skipped) in zip(
+                sessions, (result for chunk in results for result in chunk)):
+            if session_agents is not agents:  # copies made by a process pool
+                session_state = {agent.name: agent for agent in session_agents}
+                for agent in agents:
+                    state = session_state[agent.name]
+                    for attr in BARGAIN_STATE:
+                        setattr(agent, attr, getattr(state, attr))
+            contracts.extend(session_contracts)
+            self.add_surplus(*surplus)
+            self.skipped_rounds += skipped
+        return contracts
+
+    def add_surplus(self, buyer_surplus, seller_surplus, type_surplus):
+        """Adds surplus from a period to the running totals"""
+        self.buyer_surplus += buyer_surplus
+        self.seller_surplus += seller_surplus
+        self.actual_surplus = self.buyer_surplus + self.seller_surplus
+        for strategy in type_surplus:
+            self.type_surplus[strategy] = self.type_surplus.get(strategy, 0) + type_surplus[strategy]
+
+    def get_surplus(self):
+        """Returns running buyer_surplus, seller_surplus, type_surplus"""
+        return self.buyer_surplus, self.seller_surplus, self.type_surplus
+
     def get_contracts(self):
         return self.contracts
+
+    def get_contract_rows(self):
+        """Returns contracts for the last period as an integer array with columns
+           dm_contract_log.ROW_FIELDS, trader ids index self.agent_list
+        """
+        ids = self.agent_ids
+        rows = [(round_number, price, ids[buyer_id], ids[seller_id], b_unit, b_value, s_unit, s_cost)
+                for round_number, price, buyer_id, seller_id, b_unit, b_value, s_unit, s_cost
+                in self.contracts]
+        return np.array(rows, dtype=np.int64).reshape(len(rows), 8)
     
     def get_prices(self):
         return self.prices
@@ -111,6 +297,12 @@ class SimPeriod(object):
     def get_name(self):
         return self.sim_name
 
+    def get_cells(self):
+        """Returns cell ids x * grid_size + y indexed by trader id, see dm_grid_log.GridLog"""
+        g = self.grid_size
+        return np.array([x * g + y for x, y in (agent.location for agent in self.agent_list)],
+                        dtype=np.int64)
+
     def get_grid(self):
         """Returns dictionary s_grid[loc] = list of agent names at loc"""
         grid = self.travel.get_grid()
@@ -0,0 +1,257 @@
+import hashlib
+import itertools
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np                              # import numpy
+
+import environment.dm_agents as dm_agents
+import simulations.dm_sim as dm_sim
+
+# make_sim parameters a sweep config must set, in make_sim order
+SIM_PARMS = ('sim_name', 'num_periods', 'num_weeks', 'num_rounds', 'grid_size',
+             'num_traders', 'num_units', 'lower_bound', 'upper_bound',
+             'trader_objects', 'engine', 'fast_dispatch')
+
+# make_sim keyword parameters a sweep config may also set, passed on to make_sim
+SIM_OPTIONS = ('perf', 'prune', 'active_only', 'bargain_workers')
+
+# per week results kept for each (config, trial) cell
+KEEP = ('eff', 'type_effs')
+
+
+def make_configs(base_parms, grid):
+    """Returns list of make_sim parameter dictionaries, one for every
+       combination of values in grid
+       base_parms = dictionary of make_sim parameters shared by every config
+       grid = dictionary key=make_sim parameter, value = list of values to sweep
+    """
+    names = list(grid)
+    configs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        config = dict(base_parms)
+        config.update(zip(names, values))
+        missing = [parm for parm in SIM_PARMS if parm not in config]
+        if missing:
+            raise ValueError(f"sweep config is missing make_sim parameters {missing}")
+        unknown = [parm for parm in config if parm not in SIM_PARMS + SIM_OPTIONS]
+        if unknown:
+            raise ValueError(f"sweep config sets {unknown}, a sweep only passes "
+                             f"{SIM_PARMS + SIM_OPTIONS} to make_sim")
+        configs.append(config)
+    return configs
+
+
+def config_to_json(config):
+    """Returns config with trader classes replaced by their names"""
+    config = dict(config)
+    config['trader_objects'] = [(trader.__name__, num) for trader, num in config['trader_objects']]
+    return config
+
+
+def config_from_json(config):
+    """Inverse of config_to_json, strategies are looked up in the strategy
+       registry (dm_agents.STRATEGY_CLASSES); a strategy not defined in this
+       session is left as its name
+    """
+    config = dict(config)
+    config['trader_objects'] = [(dm_agents.STRATEGY_CLASSES.get(name, name), num)
+                                for name, num in config['trader_objects']]
+    return config
+
+
+def config_key(config):
+    """Short stable name for config used in cell file names"""
+    text = json.dumps(config_to_json(config), sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def config_seeds(config, num_trials, seed):
+    """Returns one SeedSequence per trial for config
+
+       Seeds come from the root seed and the config itself, so adding configs
+       to a sweep does not change the results of the others.
+    """
+    key = int(config_key(config), 16)
+    return dm_sim.make_trial_seeds(num_trials, [seed, key])
+
+
+def cell_path(path, key, trial):
+    return os.path.join(path, f"{key}_{trial}.pkl")
+
+
+def sim_options(config):
+    """Returns the SIM_OPTIONS config sets, as make_sim keyword arguments"""
+    return {parm: config[parm] for parm in SIM_OPTIONS if parm in config}
+
+
+def run_cell(config, trial_seed, setup=None):
+    """Runs make_sim for one (config, trial) cell
+       returns dictionary week -> the KEEP entries of make_sim's data
+       setup = (agents, market) from dm_sim.make_setups, None builds them here
+    """
+    data = dm_sim.make_sim(*(config[parm] for parm in SIM_PARMS), seed=trial_seed, setup=setup,
+                           **sim_options(config))
+    return {week: {item: data[week][item] for item in KEEP}
+            for week in range(config['num_weeks'])}
+
+
+def save_cell(path, key, trial, cell):
+    """Write cell so a crash never leaves a partial file behind"""
+    file_name = cell_path(path, key, trial)
+    with open(file_name + '.tmp', 'wb') as f:
+        pickle.dump(cell, f)
+    os.replace(file_name + '.tmp', file_name)
+
+
+def run_cells(path, config, key, trials, trial_seeds):
+    """Process pool worker: runs and saves the cells of config for trials,
+       their markets solved in one call, see dm_sim.make_setups
+       Each cell is saved as it finishes, returns trials.
+    """
+    setups = dm_sim.make_setups([config[parm] for parm in SIM_PARMS], trial_seeds)
+    for trial, trial_seed, setup in zip(trials, trial_seeds, setups):
+        save_cell(path, key, trial, run_cell(config, trial_seed, setup))
+    return trials
+
+
+def run_sweep(path, base_parms, grid, num_trials, seed=0, max_workers=None, verbose=True,
+              batch_size=10):
+    """Runs num_trials of make_sim for every config of make_configs(base_parms, grid)
+       on a process pool and returns load_sweep(path)
+
+       Every finished (config, trial) cell is written to directory path as it
+       completes.  Running the same sweep again skips cells already on disk,
+       so an interrupted sweep resumes where it stopped.
+       seed = int root seed, keep it the same when resuming
+       batch_size = cells of one config a worker builds and runs together
+    """
+    os.makedirs(path, exist_ok=True)
+    configs = make_configs(base_parms, grid)
+
+    # manifest of every config run in path, kept across runs
+    manifest_name = os.path.join(path, 'sweep.json')
+    manifest = {'num_trials': num_trials, 'seed': seed, 'configs': {}}
+    if os.path.exists(manifest_name):
+        with open(manifest_name) as f:
+            manifest = json.load(f)
+        if manifest['seed'] != seed:
+            raise ValueError(f"sweep in {path} was run with seed {manifest['seed']}")
+        manifest['num_trials'] = max(manifest['num_trials'], num_trials)
+    for config in configs:
+        manifest['configs'][config_key(config)] = config_to_json(config)
+    with open(manifest_name, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    # batches of cells not on disk yet, workers build their agents and markets
+    batches = []
+    for config in configs:
+        key = config_key(config)
+        todo = [(trial, trial_seed)
+                for trial, trial_seed in enumerate(config_seeds(config, num_trials, seed))
+                if not os.path.exists(cell_path(path, key, trial))]
+        for start in range(0, len(todo), batch_size):
+            trials, trial_seeds = zip(*todo[start:start + batch_size])
+            batches.append((config, key, list(trials), list(trial_seeds)))
+    num_cells = sum(len(trials) for config, key, trials, trial_seeds in batches)
+    if verbose:
+        print(f"{len(configs) * num_trials - num_cells} of {len(configs) * num_trials} cells done")
+
+    if batches:
+        left = num_cells
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(run_cells, path, config, key, trials, trial_seeds): key
+                       for config, key, trials, trial_seeds in batches}
+            for future in as_completed(futures):
+                trials = future.result()
+                left -= len(trials)
+                if verbose:
+                    print(f"config {futures[future]} trials {trials[0]}-{trials[-1]} done, {left} left")
+
+    return load_sweep(path)
+
+
+def load_sweep(path):
+    """Returns dictionary key=config_key, value = sim_data table with
+       sim_data['parms'] = config and sim_data[trial][week] for completed trials,
+       the layout make_monte_carlo returns, so analyze_eff_data can be used
+       once every trial of a config is done
+    """
+    with open(os.path.join(path, 'sweep.json')) as f:
+        sweep = json.load(f)
+    results = {}
+    for key, config in sweep['configs'].items():
+        sim_data = {'parms': config_from_json(config)}
+        for trial in range(sweep['num_trials']):
+            file_name = cell_path(path, key, trial)
+            if os.path.exists(file_name):
+                with open(file_name, 'rb') as f:
+                    sim_data[trial] = pickle.load(f)
+        results[key] = sim_data
+    return results
+
+
+def sweep_effs(results, parm):
+    """Returns list of (value of parm, eff_avg, std_errors, eff_min, eff_max)
+       for every config in results from the trials done so far, sorted by value
+    """
+    rows = []
+    for key, sim_data in results.items():
+        parms = sim_data['parms']
+        trials = sorted(trial for trial in sim_data if trial != 'parms')
+        if not trials:
+            continue
+        done = {k: sim_data[trial] for k, trial in enumerate(trials)}
+        rows.append((parms[parm],) + dm_sim.analyze_eff_data(len(trials), parms['num_weeks'], done))
+    return sorted(rows, key=lambda row: row[0])
+
+
+def run_sequential_sweep(base_parms, grid, tolerance, max_trials, seed=0, min_trials=10,
+                         batch_size=None, max_workers=None, verbose=True):
+    """Runs every config of make_configs(base_parms, grid) with
+       dm_sim.make_sequential_monte_carlo, adding trials to a config only
+       until its efficiency standard error is at most tolerance in every week
+       Returns dictionary key=config_key, value = (config, ResultsCube),
+       len(cube) is the number of trials the config used.  Trial seeds are
+       the ones run_sweep gives the same config and seed.
+    """
+    results = {}
+    for config in make_configs(base_parms, grid):
+        key = config_key(config)
+        cube = dm_sim.make_sequential_monte_carlo(
+            *(config[parm] for parm in SIM_PARMS[:1]), max_trials,
+            *(config[parm] for parm in SIM_PARMS[1:]),
+            seed=[seed, int(key, 16)], tolerance=tolerance, min_trials=min_trials,
+            batch_size=batch_size, max_workers=max_workers, sim_options=sim_options(config))
+        results[key] = (config, cube)
+        if verbose:
+            print(f"config {key} used {len(cube)} trials, largest sem {cube.get_max_sem():.3f}")
+    return results
+
+
+def sequential_effs(results, parm):
+    """Returns list of (value of parm, trials used, largest sem, eff_avg,
+       std_errors, eff_min, eff_max) for every config of run_sequential_sweep,
+       sorted by value
+    """
+    rows = []
+    for config, cube in results.values():
+        rows.append((config[parm], len(cube), cube.get_max_sem()) + cube.analyze_eff_data())
+    return sorted(rows, key=lambda row: row[0])
+
+
+if __name__ == "__main__":
+    # grid size study, rerun after an interruption to resume
+
+    ZID = dm_agents.ZID
+    ZIDA = dm_agents.ZIDA
+    base_parms = {'sim_name': 'GRID SWEEP', 'num_periods': 7, 'num_weeks': 20,
+                  'num_rounds': 5, 'grid_size': 15, 'num_traders': 20, 'num_units': 8,
+                  'lower_bound': 200, 'upper_bound': 600,
+                  'trader_objects': [(ZID, 10), (ZIDA, 10)],
+                  'engine': 'object', 'fast_dispatch': True}
+    grid = {'grid_size': [2, 4, 8, 15, 30]}
+    results = run_sweep('grid_sweep', base_parms, grid, num_trials=10, seed=1)
+    for grid_size, eff_avg, std_errors, eff_min, eff_max in sweep_effs(results, 'grid_size'):
+        print(grid_size, np.round(eff_avg[-1], 2), np.round(std_errors[-1], 2))